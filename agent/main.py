@@ -1,18 +1,17 @@
 import os
 import time
 from typing import List, Tuple
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 from striprtf.striprtf import rtf_to_text
 import subprocess
 from PIL import Image
 import torch
-from transformers import CLIPProcessor, CLIPModel
-from transformers import BlipProcessor, BlipForConditionalGeneration
 import re
-import concurrent.futures
 import json
+from modelStore import load_blip, load_clip, load_text_model, load_yolo
+from parseSupervisor import ParseSupervisor, PARSE_TIMEOUT_SECONDS
+from textReader import read_text
 
 
 # Config constants
@@ -27,31 +26,31 @@ os.makedirs(CACHE_DIR, exist_ok=True)
 # Setup device
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Load models
+# Load models (from the local model store when prefetched; see modelStore.py)
 def load_models():
     print("[INFO] Loading YOLOv5 model...")
     yolo = None
     try:
-        yolo = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True).to(device)
-        yolo.eval()
+        yolo = load_yolo(device)
         print("[INFO] YOLOv5 loaded.")
     except Exception as e:
         print(f"[WARNING] YOLOv5 loading failed: {e}")
     print("[INFO] Loading CLIP models...")
-    clip_proc = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-    clip_mod = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
-    clip_mod.eval()
+    clip_proc, clip_mod = load_clip(device)
     print("[INFO] Loading BLIP models...")
-    blip_proc = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-    blip_mod = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base").to(device)
-    blip_mod.eval()
+    blip_proc, blip_mod = load_blip(device)
     print("[INFO] All models loaded.")
     return yolo, clip_proc, clip_mod, blip_proc, blip_mod
 
 
 # Parsing functions (same as before)
 def parse_rtf_unrtf(file_path):
-    result = subprocess.run(['unrtf', '--text', file_path], capture_output=True, text=True)
+    try:
+        result = subprocess.run(['unrtf', '--text', file_path], capture_output=True, text=True,
+                                timeout=PARSE_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        print(f"[WARNING] UnRTF timed out on {file_path}")
+        return ""
     if result.returncode == 0:
         return result.stdout.strip()
     else:
@@ -63,11 +62,11 @@ def clean_text(text: str) -> str:
     return '\n'.join([line for line in lines if line])
 
 def parse_txt(filepath: str) -> str:
+    # Encoding is sniffed once and the file decoded in chunks, up to TEXT_BYTE_BUDGET bytes.
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
-    except UnicodeDecodeError:
-        print(f"[WARNING] Skipping non-UTF8 or binary file: {filepath}")
+        return read_text(filepath)
+    except UnicodeError:
+        print(f"[WARNING] Skipping binary file or unsupported encoding: {filepath}")
         return ""
 
 def parse_pdf(filepath: str) -> str:
@@ -114,29 +113,22 @@ def get_all_files_and_parse_optimized(directory: str,
     text_paths = []
     image_paths = []
 
-    def parse_single_file(path):
-        try:
+    print(f"[INFO] Walking directory {directory} and parsing files...")
+    text_candidates = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            path = os.path.join(root, file)
             if path.lower().endswith(text_exts):
-                return 'text', parse_file(path), path
+                text_candidates.append(path)
             elif path.lower().endswith(image_exts):
-                return 'image', None, path
-        except Exception as e:
-            print(f"[WARNING] Error parsing {path}: {e}")
-        return None, None, None
-
-    print(f"[INFO] Walking directory {directory} and parsing files...")
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        futures = [executor.submit(parse_single_file, os.path.join(root, file))
-                   for root, _, files in os.walk(directory) for file in files]
-
-        for future in concurrent.futures.as_completed(futures):
-            typ, content, path = future.result()
-            if typ == 'text' and content:
-                text_texts.append(content)
-                text_paths.append(path)
-            elif typ == 'image' and path:
                 image_paths.append(path)
 
+    supervisor = ParseSupervisor(parse_file, os.path.join(CACHE_DIR, 'parse_quarantine.json'))
+    for path, content, ok in supervisor.imap(text_candidates):
+        if content:
+            text_texts.append(content)
+            text_paths.append(path)
+
     return text_texts, text_paths, image_paths
 
 
@@ -174,7 +166,7 @@ def load_embeddings_captions(save_dir):
 
 def embed_and_index_texts(texts: List[str]):
     print("[INFO] Embedding texts with SentenceTransformer...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    model = load_text_model()
     embeddings = model.encode(texts, convert_to_tensor=False)
     embeddings_np = np.array(embeddings).astype('float32')
     dim = embeddings_np.shape[1]
@@ -259,9 +251,7 @@ def build_image_index(embeddings_np: np.ndarray):
     index.add(embeddings_np)
     return index
 
-from sentence_transformers import SentenceTransformer as ST
-
-_word_embedding_model = ST('all-MiniLM-L6-v2')
+_word_embedding_model = load_text_model()
 
 def _get_word_embeddings(words: List[str]):
     return _word_embedding_model.encode(words, convert_to_tensor=False)
@@ -1,28 +1,17 @@
-import re
+from textReader import TEXT_BYTE_BUDGET, iter_semantic_sentences, iter_text_chunks
 
-def parse_txt(filepath: str) -> str:
+def parse_txt(filepath: str, byte_budget: int = TEXT_BYTE_BUDGET) -> str:
     """
-    Reads a text file, handling UTF-8 and UTF-16 encodings safely.
+    Reads a text file in one streaming pass, with the encoding detected once
+    from its BOM or first bytes (UTF-8, UTF-16, UTF-32), up to `byte_budget` bytes.
     Extracts only semantic sentences and skips metadata-like lines.
     """
-    encodings_to_try = ["utf-8", "utf-16", "utf-16-le", "utf-16-be"]
-
-    raw_text = None
-    for enc in encodings_to_try:
-        try:
-            with open(filepath, "r", encoding=enc) as f:
-                raw_text = f.read()
-            break  # success, stop trying
-        except UnicodeDecodeError:
-            continue
-        except Exception as e:
-            print(f"Error opening {filepath} with {enc}: {e}")
-            return ""
-
-    if raw_text is None:
+    try:
+        # Extract semantic-looking sentences (basic heuristic), chunk by chunk
+        return " ".join(iter_semantic_sentences(iter_text_chunks(filepath, byte_budget)))
+    except UnicodeError:
         print(f"Skipping non-text or unsupported encoding: {filepath}")
         return ""
-
-    # Extract semantic-looking sentences (basic heuristic)
-    semantic_lines = re.findall(r"[A-Z0-9][^.!?\n]*[.!?]", raw_text, flags=re.M)
-    return " ".join(semantic_lines)
\ No newline at end of file
+    except Exception as e:
+        print(f"Error opening {filepath}: {e}")
+        return ""
@@ -5,6 +5,9 @@ import pytesseract
 import PyPDF2
 import sys
 import json
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from textReader import read_text
 
 
 def parse_file(file_path):
@@ -12,8 +15,10 @@ def parse_file(file_path):
     ext = ext.lower()
 
     if ext in ['.txt', '.md', '.csv', '.json', '.log']:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        try:
+            content = read_text(file_path)
+        except UnicodeError as e:
+            return {"type": "text", "error": str(e)}
         return {"type": "text", "content": content}
 
     elif ext == '.pdf':
@@ -57,7 +62,78 @@ def parse_file(file_path):
 
     else:
         return {"type": "unknown", "notice": "File type not supported in this parser."}
+
+
+def parse_file_safe(file_path):
+    try:
+        result = parse_file(file_path)
+    except Exception as e:
+        result = {"type": "error", "error": str(e)}
+    return {"path": file_path, **result}
+
+
+def _parse_in_pool(file_paths, workers):
+    """
+    Yield the results that finished in one process pool and return the paths
+    left unparsed because a worker died and took the pool down with it.
+    """
+    broken = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for position, file_path in enumerate(file_paths):
+            try:
+                futures[executor.submit(parse_file_safe, file_path)] = file_path
+            except BrokenProcessPool:
+                broken.extend(file_paths[position:])
+                break
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                broken.append(futures[future])
+                continue
+            yield result
+    return broken
+
+
+def parse_many(file_paths, workers=None):
+    """
+    Parse files in a process pool and yield each result (tagged with its path)
+    as soon as it finishes, so one interpreter and one set of imports serve the
+    whole batch.
+
+    A parser that crashes its worker (a native library segfaulting, the OOM
+    killer) breaks the pool for every file still queued. Those files
+    are then parsed again one process each, so only the culprit comes back as
+    an error line and the rest of the batch still gets its results.
+    """
+    workers = workers or min(len(file_paths), os.cpu_count() or 1)
+    if workers <= 1:
+        for file_path in file_paths:
+            yield parse_file_safe(file_path)
+        return
+    broken = yield from _parse_in_pool(file_paths, workers)
+    if broken:
+        print(f"[WARNING] A parser process crashed; retrying {len(broken)} files one at a time.", file=sys.stderr)
+    for file_path in broken:
+        if (yield from _parse_in_pool([file_path], 1)):
+            yield {"path": file_path, "type": "error", "error": "parser process crashed"}
+
+
 if __name__ == '__main__':
-    file_path = sys.argv[1]
-    result = parse_file(file_path)
-    print(json.dumps(result))
\ No newline at end of file
+    # fileParse.py <path>                 -> one JSON object (original behaviour)
+    # fileParse.py [--workers N] <p1> <p2> ... -> one JSON line per file, in completion order
+    # fileParse.py [--workers N] -        -> same, with paths read one per line from stdin
+    args = sys.argv[1:]
+    workers = None
+    if len(args) >= 2 and args[0] == '--workers':
+        workers = int(args[1])
+        args = args[2:]
+    if len(args) == 1 and args[0] != '-' and workers is None:
+        result = parse_file(args[0])
+        print(json.dumps(result))
+    else:
+        if args == ['-']:
+            args = [line.strip() for line in sys.stdin if line.strip()]
+        for result in parse_many(args, workers):
+            print(json.dumps(result), flush=True)
\ No newline at end of file
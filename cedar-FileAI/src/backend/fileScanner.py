@@ -0,0 +1,165 @@
+import os
+import re
+import sys
+from collections import namedtuple
+from typing import Dict, Iterator, List, Optional, Set
+
+
+TEXT_EXTENSIONS = ('.txt', '.pdf', '.docx', '.rtf')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+EXTENSION_KINDS: Dict[str, str] = {
+    **{ext: 'text' for ext in TEXT_EXTENSIONS},
+    **{ext: 'image' for ext in IMAGE_EXTENSIONS},
+}
+
+# Directories that never hold user documents worth indexing; pruned before descending.
+DEFAULT_IGNORED_DIRS = frozenset({
+    '.git', '.hg', '.svn', 'node_modules', '__pycache__', '.venv', 'venv', '.tox', '.nox',
+    '.mypy_cache', '.pytest_cache', '.ruff_cache', '.cache', '.cache_fileai', '.next', '.mastra',
+    '.Trash', '.Spotlight-V100', '.fseventsd',
+})
+
+IGNORE_FILE = '.gitignore'
+
+ScanEntry = namedtuple('ScanEntry', ['path', 'kind', 'mtime_ns', 'size'])
+
+
+def file_kind(path: str, extension_kinds: Dict[str, str] = EXTENSION_KINDS) -> Optional[str]:
+    return extension_kinds.get(os.path.splitext(path)[1].lower())
+
+
+def _glob_to_regex(pattern: str) -> str:
+    out, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[' + body + ']')
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+class IgnoreRule:
+    """One .gitignore line, matched against paths relative to the file's directory."""
+
+    def __init__(self, line: str):
+        self.negate = line.startswith('!')
+        if self.negate:
+            line = line[1:]
+        self.dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        # A pattern with a slash (other than a trailing one) is anchored to its .gitignore.
+        anchored = '/' in line
+        line = line.lstrip('/')
+        prefix = '' if anchored else '(?:.*/)?'
+        self.regex = re.compile(prefix + _glob_to_regex(line) + '$')
+
+    def matches(self, rel_path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        return self.regex.match(rel_path) is not None
+
+
+def load_ignore_rules(directory: str) -> List[IgnoreRule]:
+    try:
+        with open(os.path.join(directory, IGNORE_FILE), 'r', encoding='utf-8', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    rules = []
+    for line in lines:
+        line = line.rstrip()
+        if line and not line.startswith('#'):
+            rules.append(IgnoreRule(line))
+    return rules
+
+
+def _is_ignored(path: str, is_dir: bool, rule_stack) -> bool:
+    ignored = False
+    for base, rules in rule_stack:
+        rel_path = path[len(base) + 1:].replace(os.sep, '/')
+        for rule in rules:
+            if rule.matches(rel_path, is_dir):
+                ignored = not rule.negate
+    return ignored
+
+
+def scan_files(root: str, kinds: Optional[Set[str]] = None,
+               extension_kinds: Dict[str, str] = EXTENSION_KINDS,
+               ignored_dirs=DEFAULT_IGNORED_DIRS, use_ignore_files: bool = True) -> Iterator[ScanEntry]:
+    """
+    Stream every indexable file under `root` as a ScanEntry (absolute normalized
+    path, kind, mtime_ns, size).
+
+    Built on os.scandir: directory checks use the cached d_type, files are
+    classified by a dict lookup on their extension before anything else, and
+    only files that match are stat'ed. Directories in `ignored_dirs` or matched
+    by a .gitignore on the way down are pruned before they are opened. `kinds`
+    restricts output to e.g. {'text'}.
+    """
+    root = os.path.normpath(os.path.abspath(root))
+    if os.path.isfile(root):
+        kind = file_kind(root, extension_kinds)
+        if kind is not None and (kinds is None or kind in kinds):
+            st = os.stat(root)
+            yield ScanEntry(root, kind, st.st_mtime_ns, st.st_size)
+        return
+
+    # Each stack item carries the .gitignore rules in force for that directory.
+    stack = [(root, [])]
+    while stack:
+        directory, rule_stack = stack.pop()
+        if use_ignore_files:
+            rules = load_ignore_rules(directory)
+            if rules:
+                rule_stack = rule_stack + [(directory, rules)]
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            print(f"[WARNING] Cannot scan {directory}: {e}", file=sys.stderr)
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in ignored_dirs or (rule_stack and _is_ignored(entry.path, True, rule_stack)):
+                        continue
+                    subdirs.append(entry.path)
+                    continue
+                # Symlinked files are indexed (and stat'ed) as their targets; symlinked
+                # directories are not followed, so a link cycle cannot trap the walk.
+                if not entry.is_file():
+                    continue
+                kind = extension_kinds.get(os.path.splitext(entry.name)[1].lower())
+                if kind is None or (kinds is not None and kind not in kinds):
+                    continue
+                if rule_stack and _is_ignored(entry.path, False, rule_stack):
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            yield ScanEntry(entry.path, kind, st.st_mtime_ns, st.st_size)
+        stack.extend((subdir, rule_stack) for subdir in reversed(subdirs))
@@ -0,0 +1,76 @@
+from typing import List, Tuple
+
+import faiss
+import numpy as np
+
+from segmentStore import pool_regions
+from vectorProjection import search_vectors
+
+
+# Distinct images taken from the pooled first stage per requested result.
+IMAGE_CANDIDATE_FACTOR = 3
+
+
+class ImageRegionIndex:
+    """
+    Two-level index over region embeddings.
+
+    Each image gets one pooled vector (the normalized mean of its region
+    vectors) in a small per-image index. A query first retrieves
+    k * IMAGE_CANDIDATE_FACTOR distinct images from that index, then scores only
+    those images' regions exactly against the full vectors. An image with many
+    near-identical regions therefore takes one slot, and the second stage costs
+    at most MAX_IMAGE_REGIONS rows per candidate.
+
+    The pooled vectors are stored with the image segments and passed in as
+    `pooled_np`, so a search does not pool every region of the corpus again.
+    """
+
+    def __init__(self, embeddings_np, image_to_region, image_count: int, projection=None, pooled_np=None):
+        self.embeddings_np = embeddings_np
+        self.projection = projection
+        self.region_images = np.fromiter((img_idx for img_idx, _ in image_to_region), dtype=np.int64,
+                                         count=len(image_to_region))
+        self.region_order = np.argsort(self.region_images, kind='stable')
+        counts = np.bincount(self.region_images, minlength=image_count)
+        self.row_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        if pooled_np is None:
+            pooled_np = pool_regions(embeddings_np, self.region_images, image_count)
+        # Images whose ingestion produced no regions are left out of the first stage.
+        self.pooled_images = np.flatnonzero(counts)
+        self.pooled_np = np.ascontiguousarray(pooled_np[self.pooled_images], dtype=np.float32)
+        if projection is not None:
+            self.pooled_index = projection.build_index(self.pooled_np)
+        else:
+            self.pooled_index = faiss.IndexFlatL2(self.pooled_np.shape[1])
+            self.pooled_index.add(self.pooled_np)
+
+    def regions_of(self, img_idx: int) -> np.ndarray:
+        return self.region_order[self.row_offsets[img_idx]:self.row_offsets[img_idx + 1]]
+
+    def search(self, query_np, k: int, ids=None) -> List[Tuple[float, int]]:
+        """
+        (distance, region_row) of the best region of each candidate image, closest
+        first. `ids` restricts the search to these region rows' images.
+        """
+        query_np = np.asarray(query_np, dtype=np.float32).reshape(1, -1)
+        pooled_ids = None
+        if ids is not None:
+            pooled_ids = np.searchsorted(self.pooled_images, np.unique(self.region_images[ids]))
+            if pooled_ids.size == 0:
+                return []
+        fetch = k * IMAGE_CANDIDATE_FACTOR
+        _, candidates = search_vectors(self.pooled_index, self.pooled_np, query_np, fetch, pooled_ids,
+                                       self.projection)
+        images = self.pooled_images[candidates[0]]
+        if images.size == 0:
+            return []
+        rows = np.concatenate([self.regions_of(img_idx) for img_idx in images])
+        dists = ((np.asarray(self.embeddings_np[rows], dtype=np.float32) - query_np) ** 2).sum(axis=1)
+        best = {}
+        for row, dist in zip(rows.tolist(), dists.tolist()):
+            img_idx = int(self.region_images[row])
+            if img_idx not in best or dist < best[img_idx][0]:
+                best[img_idx] = (dist, row)
+        return sorted(best.values())
@@ -0,0 +1,85 @@
+import gc
+import multiprocessing
+import os
+import sys
+from typing import Callable, Iterator, List, Tuple
+
+
+# Set in the parent right before forking; children inherit it (and the models it closes over).
+_embed_fn = None
+# Set once this process has run inference of its own; forking after that is refused.
+_inference_ran = False
+
+
+def _init_worker(threads: int):
+    import torch
+    torch.set_num_threads(threads)
+
+
+def _embed_one(task):
+    img_idx, img_path = task
+    try:
+        return img_idx, _embed_fn(img_path), None
+    except Exception as e:
+        return img_idx, None, str(e)
+
+
+def fork_available() -> bool:
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def note_inference():
+    """Record that this process ran model inference, so later pools embed in-process."""
+    global _inference_ran
+    _inference_ran = True
+
+
+class ForkedImageWorkers:
+    """
+    Runs `embed_fn(path) -> (embeddings, captions)` for many images in forked
+    worker processes that share the parent's already-loaded models.
+
+    The models are loaded once in the parent; fork() gives every worker the same
+    weight pages copy-on-write, and since inference only reads them, RAM stays
+    near one copy however many workers run. Each worker gets cores // workers
+    intra-op threads. Results come back in input order, so they can be added to
+    an index or checkpoint exactly as the sequential loop would.
+
+    The parent must not have run any inference before the pool starts: an
+    OpenMP runtime that was already active can hang in forked children. Callers
+    that run inference in the parent say so with note_inference(), after which
+    the pool does not fork. Where fork is unavailable, after inference, or with
+    one worker, images are embedded in-process.
+    """
+
+    def __init__(self, embed_fn: Callable, workers: int, threads_per_worker: int = None):
+        self.embed_fn = embed_fn
+        self.workers = workers if fork_available() else 1
+        self.threads = threads_per_worker or max(1, (os.cpu_count() or 1) // max(1, self.workers))
+
+    def imap(self, image_paths: List[str], start: int = 0) -> Iterator[Tuple[int, object, str]]:
+        """Yield (img_idx, result, error) for image_paths[start:], in order."""
+        global _embed_fn
+        tasks = [(img_idx, image_paths[img_idx]) for img_idx in range(start, len(image_paths))]
+        if self.workers > 1 and len(tasks) > 1 and _inference_ran:
+            print("[INFO] This process already ran inference; embedding images without forking.", file=sys.stderr)
+        if self.workers <= 1 or len(tasks) <= 1 or _inference_ran:
+            _embed_fn = self.embed_fn
+            for task in tasks:
+                yield _embed_one(task)
+            return
+
+        print(f"[INFO] Forking {self.workers} image workers ({self.threads} threads each)...", file=sys.stderr)
+        _embed_fn = self.embed_fn
+        # Keep the cyclic GC from touching (and so un-sharing) the parent's objects in the children.
+        gc.freeze()
+        pool = multiprocessing.get_context('fork').Pool(self.workers, initializer=_init_worker,
+                                                        initargs=(self.threads,))
+        try:
+            for result in pool.imap(_embed_one, tasks, chunksize=1):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            gc.unfreeze()
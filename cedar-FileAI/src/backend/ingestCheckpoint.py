@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+
+# Flush a chunk after this many images or seconds, whichever comes first.
+CHECKPOINT_EVERY_IMAGES = 200
+CHECKPOINT_EVERY_SECONDS = 300
+
+
+def atomic_write_json(file_path: str, data):
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def _job_id(image_paths: List[str]) -> str:
+    return hashlib.sha1("\n".join(image_paths).encode('utf-8')).hexdigest()
+
+
+class IngestCheckpoint:
+    """
+    On-disk progress for one image ingestion job (one ordered list of paths).
+
+    Completed images are buffered and written out as numbered chunk files
+    (embeddings, captions and (img_idx, region_idx) pairs); after each chunk is
+    safely on disk, progress.json is atomically replaced with the position of
+    the next unprocessed image. Restarting with the same path list resumes from
+    there; a different list starts a fresh job.
+    """
+
+    def __init__(self, checkpoint_dir: str, image_paths: List[str],
+                 every_images: int = CHECKPOINT_EVERY_IMAGES, every_seconds: float = CHECKPOINT_EVERY_SECONDS):
+        self.checkpoint_dir = checkpoint_dir
+        self.every_images = every_images
+        self.every_seconds = every_seconds
+        self.job_id = _job_id(image_paths)
+        self.next_image = 0
+        self.chunks = []
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        progress = self._load_progress()
+        if progress is not None and progress.get('job_id') == self.job_id:
+            self.next_image = progress['next_image']
+            self.chunks = progress['chunks']
+            if self.next_image:
+                print(f"[INFO] Resuming image ingestion at image {self.next_image}/{len(image_paths)}", file=sys.stderr)
+        else:
+            self.clear()
+        self._reset_buffer()
+
+    def _load_progress(self):
+        try:
+            with open(os.path.join(self.checkpoint_dir, 'progress.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _reset_buffer(self):
+        self.buf_embeddings = []
+        self.buf_captions = []
+        self.buf_regions = []
+        self.buf_next_image = self.next_image
+        self.last_flush = time.monotonic()
+
+    def add(self, img_idx: int, embeddings: np.ndarray, captions: List[str]):
+        """Record a finished image; failed images are recorded with no regions so they are not retried."""
+        if embeddings is not None and len(captions) > 0:
+            self.buf_embeddings.append(np.asarray(embeddings, dtype='float32'))
+            self.buf_captions.extend(captions)
+            self.buf_regions.extend((img_idx, i) for i in range(len(captions)))
+        self.buf_next_image = img_idx + 1
+        if (self.buf_next_image - self.next_image >= self.every_images
+                or time.monotonic() - self.last_flush >= self.every_seconds):
+            self.flush()
+
+    def flush(self):
+        if self.buf_next_image == self.next_image:
+            return
+        if self.buf_embeddings:
+            name = f"chunk_{len(self.chunks):06d}.npz"
+            tmp_path = os.path.join(self.checkpoint_dir, name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, embeddings=np.vstack(self.buf_embeddings),
+                         captions=np.array(self.buf_captions, dtype=str),
+                         regions=np.array(self.buf_regions, dtype=np.int64).reshape(-1, 2))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(self.checkpoint_dir, name))
+            self.chunks.append({"file": name, "rows": len(self.buf_captions)})
+        self.next_image = self.buf_next_image
+        atomic_write_json(os.path.join(self.checkpoint_dir, 'progress.json'),
+                          {"job_id": self.job_id, "next_image": self.next_image, "chunks": self.chunks})
+        self._reset_buffer()
+
+    def iter_chunks(self):
+        for chunk in self.chunks:
+            data = np.load(os.path.join(self.checkpoint_dir, chunk['file']))
+            yield data['embeddings'], data['captions'].tolist(), [tuple(r) for r in data['regions'].tolist()]
+
+    def assemble(self) -> Tuple[np.ndarray, List[Tuple[int, int]], List[str]]:
+        """
+        Concatenate all chunks into a memory-mapped embeddings file, one chunk in
+        memory at a time. Returns (embeddings, image_to_region, captions).
+        """
+        total = sum(chunk['rows'] for chunk in self.chunks)
+        embeddings = None
+        image_to_region, captions = [], []
+        row = 0
+        for emb, caps, regions in self.iter_chunks():
+            if embeddings is None:
+                out_path = os.path.join(self.checkpoint_dir, 'embeddings.npy')
+                embeddings = np.lib.format.open_memmap(out_path, mode='w+', dtype='float32', shape=(total, emb.shape[1]))
+            embeddings[row:row + emb.shape[0]] = emb
+            row += emb.shape[0]
+            captions.extend(caps)
+            image_to_region.extend(regions)
+        embeddings.flush()
+        return embeddings, image_to_region, captions
+
+    def clear(self):
+        for name in os.listdir(self.checkpoint_dir):
+            if name.startswith('chunk_') or name in ('progress.json', 'embeddings.npy'):
+                os.remove(os.path.join(self.checkpoint_dir, name))
+        self.next_image = 0
+        self.chunks = []
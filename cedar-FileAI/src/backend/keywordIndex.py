@@ -0,0 +1,154 @@
+import math
+import re
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class KeywordIndex:
+    """
+    Inverted index with BM25 statistics over the rows of the text index.
+
+    Postings are kept as flat (term_id, doc_id, tf) arrays sorted by term, with
+    `offsets[t]:offsets[t + 1]` giving the slice for term t, so the whole index
+    saves and loads as a handful of numpy arrays and never needs the raw text.
+
+    Added documents are buffered and merged into the sorted arrays once, the next
+    time the postings are read, so building an index window by window stays linear.
+    """
+
+    def __init__(self, vocab=None, term_ids=None, doc_ids=None, tfs=None, doc_lens=None, presorted=False):
+        self.vocab = list(vocab) if vocab is not None else []
+        self.term_of = {term: i for i, term in enumerate(self.vocab)}
+        self.term_ids = term_ids if term_ids is not None else np.array([], dtype=np.int64)
+        self.doc_ids = doc_ids if doc_ids is not None else np.array([], dtype=np.int64)
+        self.tfs = tfs if tfs is not None else np.array([], dtype=np.int32)
+        self.doc_lens = doc_lens if doc_lens is not None else np.array([], dtype=np.int32)
+        # (term_ids, doc_ids, tfs, doc_lens) batches not yet merged into the arrays above.
+        self.pending = []
+        self.pending_docs = 0
+        if not presorted:
+            order = np.lexsort((self.doc_ids, self.term_ids))
+            self.term_ids, self.doc_ids, self.tfs = self.term_ids[order], self.doc_ids[order], self.tfs[order]
+        self._finalize()
+
+    def _finalize(self):
+        counts = np.bincount(self.term_ids, minlength=len(self.vocab))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.avgdl = float(self.doc_lens.mean()) if self.doc_lens.size else 0.0
+
+    def _merge_pending(self):
+        if not self.pending:
+            return
+        terms, docs, tfs, lens = zip(*self.pending)
+        self.term_ids = np.concatenate((self.term_ids,) + terms)
+        self.doc_ids = np.concatenate((self.doc_ids,) + docs)
+        self.tfs = np.concatenate((self.tfs,) + tfs)
+        self.doc_lens = np.concatenate((self.doc_lens,) + lens)
+        self.pending, self.pending_docs = [], 0
+        # Every batch is sorted by (term, doc) and holds higher doc ids than the ones
+        # before it, so a stable sort by term alone restores the order; it only has
+        # to merge the sorted runs.
+        order = np.argsort(self.term_ids, kind='stable')
+        self.term_ids, self.doc_ids, self.tfs = self.term_ids[order], self.doc_ids[order], self.tfs[order]
+        self._finalize()
+
+    @property
+    def num_docs(self) -> int:
+        return int(self.doc_lens.size) + self.pending_docs
+
+    def _append(self, term_ids, doc_ids, tfs, doc_lens, presorted=False):
+        if not presorted:
+            order = np.lexsort((doc_ids, term_ids))
+            term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+        self.pending.append((term_ids, doc_ids + self.num_docs, tfs, doc_lens))
+        self.pending_docs += int(doc_lens.size)
+
+    def add_documents(self, texts: List[str]):
+        """Append documents; they get doc ids num_docs, num_docs + 1, ..."""
+        new_terms, new_docs, new_tfs, new_lens = [], [], [], []
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            new_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                if term not in self.term_of:
+                    self.term_of[term] = len(self.vocab)
+                    self.vocab.append(term)
+                new_terms.append(self.term_of[term])
+                new_docs.append(i)
+                new_tfs.append(tf)
+        self._append(np.array(new_terms, dtype=np.int64), np.array(new_docs, dtype=np.int64),
+                     np.array(new_tfs, dtype=np.int32), np.array(new_lens, dtype=np.int32))
+
+    def extend(self, other: 'KeywordIndex'):
+        """Append the documents of another index, in order, after this one's."""
+        other._merge_pending()
+        term_map = np.empty(len(other.vocab), dtype=np.int64)
+        for i, term in enumerate(other.vocab):
+            if term not in self.term_of:
+                self.term_of[term] = len(self.vocab)
+                self.vocab.append(term)
+            term_map[i] = self.term_of[term]
+        if other.num_docs:
+            # A vocabulary that maps in order (always the case for the first index extended) keeps the sort.
+            presorted = bool(np.all(np.diff(term_map) > 0))
+            self._append(term_map[other.term_ids], other.doc_ids, other.tfs, other.doc_lens, presorted)
+
+    def keep_documents(self, keep: np.ndarray):
+        """Drop every document not in `keep` and renumber the survivors 0..len(keep)-1 in order."""
+        self._merge_pending()
+        mapping = np.full(self.num_docs, -1, dtype=np.int64)
+        mapping[keep] = np.arange(len(keep), dtype=np.int64)
+        remapped = mapping[self.doc_ids] if self.doc_ids.size else self.doc_ids
+        alive = remapped >= 0
+        # Renumbering keeps the doc order, so the postings stay sorted.
+        self.term_ids, self.doc_ids, self.tfs = self.term_ids[alive], remapped[alive], self.tfs[alive]
+        self.doc_lens = self.doc_lens[keep]
+        self._finalize()
+
+    def score(self, query: str, ids: Optional[np.ndarray] = None):
+        """
+        BM25 scores for every document matching at least one query term, returned
+        as (doc_ids, scores). `ids`, if given, must be sorted and limits the
+        candidates to those rows.
+        """
+        self._merge_pending()
+        terms = [self.term_of[t] for t in set(tokenize(query)) if t in self.term_of]
+        if not terms or self.num_docs == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        all_docs, all_scores = [], []
+        for t in terms:
+            lo, hi = self.offsets[t], self.offsets[t + 1]
+            docs, tf = self.doc_ids[lo:hi], self.tfs[lo:hi].astype(np.float32)
+            df = hi - lo
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            if ids is not None:
+                mask = np.isin(docs, ids, assume_unique=True)
+                docs, tf = docs[mask], tf[mask]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lens[docs] / max(self.avgdl, 1e-6))
+            all_docs.append(docs)
+            all_scores.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        doc_ids, inverse = np.unique(np.concatenate(all_docs), return_inverse=True)
+        return doc_ids, np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+
+    def arrays(self, prefix: str = '') -> dict:
+        """The index as named numpy arrays, for storing inside another .npz."""
+        self._merge_pending()
+        return {prefix + 'vocab': np.array(self.vocab, dtype=str), prefix + 'term_ids': self.term_ids,
+                prefix + 'doc_ids': self.doc_ids, prefix + 'tfs': self.tfs, prefix + 'doc_lens': self.doc_lens}
+
+    @classmethod
+    def from_arrays(cls, data, prefix: str = ''):
+        return cls(data[prefix + 'vocab'].tolist(), data[prefix + 'term_ids'], data[prefix + 'doc_ids'],
+                   data[prefix + 'tfs'], data[prefix + 'doc_lens'], presorted=True)
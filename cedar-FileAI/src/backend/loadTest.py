@@ -0,0 +1,486 @@
+"""
+Concurrent load test for the search tool path.
+
+Builds a synthetic corpus in a scratch directory, then replays a mix of text,
+image and mixed queries against semanticSearch.py at a fixed concurrency, either
+as one CLI process per request (what the Mastra tool does) or as threads
+calling run_method() in this process. A mutator thread can keep editing,
+creating and deleting files meanwhile so that requests race on cache updates.
+
+Reports p50/p95/p99 latency, throughput, peak RSS and every sign of a cache
+race: failed requests, cache reads that fell back to "no usable cache", results
+pointing at files that never existed, and an index that fails its invariants
+after the run.
+
+    python loadTest.py --stub-models --concurrency 8 --requests 200 --files 2000
+    python loadTest.py --mode inprocess --stub-models --mutate-interval 0.2
+
+--stub-models swaps MiniLM, CLIP and BLIP for small deterministic hashing
+models (torch must still be importable), so the harness runs offline and
+measures the pipeline rather than the networks.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SEARCH_SCRIPT = os.path.join(BACKEND_DIR, 'semanticSearch.py')
+
+WORDS = (
+    'invoice budget meeting contract travel receipt project deadline report summary client '
+    'design review schedule payment tax salary holiday flight hotel recipe garden dog cat '
+    'beach mountain river concert ticket insurance policy medical lease apartment car repair '
+    'warranty manual lecture notes exam thesis draft proposal grant research dataset model '
+    'server deploy backup password network printer kitchen birthday wedding photo album'
+).split()
+
+# stderr lines that mean a request found the cache unreadable, e.g. mid-rewrite.
+CACHE_READ_FAILURES = ('No usable text index cache', 'Failed to load cached embeddings')
+
+STUB_SENTENCE_TRANSFORMERS = '''
+import zlib
+
+import numpy as np
+
+
+class SentenceTransformer:
+    """Hashed bag-of-words stand-in for MiniLM (384-d, L2-normalized)."""
+
+    DIM = 384
+
+    def __init__(self, model_name_or_path=None, device=None, **kwargs):
+        pass
+
+    def get_sentence_embedding_dimension(self):
+        return self.DIM
+
+    def encode(self, sentences, batch_size=32, convert_to_tensor=False, **kwargs):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        out = np.zeros((len(sentences), self.DIM), dtype=np.float32)
+        for i, text in enumerate(sentences):
+            for word in text.lower().split():
+                out[i, zlib.crc32(word.encode("utf-8")) % self.DIM] += 1.0
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out[0] if single else out
+'''
+
+STUB_TRANSFORMERS = '''
+import zlib
+
+import numpy as np
+
+
+class _Features(np.ndarray):
+    """Just enough of the torch.Tensor API for semanticSearch's CLIP helpers."""
+
+    def norm(self, p=2, dim=-1, keepdim=False):
+        return np.linalg.norm(np.asarray(self), ord=p, axis=dim, keepdims=keepdim).view(_Features)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return np.asarray(self)
+
+
+class _Inputs(dict):
+    def to(self, device):
+        return self
+
+
+class _Processor:
+    @classmethod
+    def from_pretrained(cls, *args, **kwargs):
+        return cls()
+
+    def __call__(self, text=None, images=None, **kwargs):
+        return _Inputs(text=text, images=images)
+
+    def decode(self, ids, skip_special_tokens=True):
+        return ""
+
+
+class _Model:
+    DIM = 512
+
+    @classmethod
+    def from_pretrained(cls, *args, **kwargs):
+        return cls()
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def _features(self, keys):
+        out = np.zeros((len(keys), self.DIM), dtype=np.float32)
+        for i, key in enumerate(keys):
+            for word in str(key).lower().split():
+                out[i, zlib.crc32(word.encode("utf-8")) % self.DIM] += 1.0
+        return out.view(_Features)
+
+    def get_text_features(self, text=None, **kwargs):
+        return self._features(text)
+
+    def get_image_features(self, images=None, **kwargs):
+        return self._features([id(image) for image in images])
+
+    def generate(self, images=None, **kwargs):
+        return [[] for _ in images]
+
+
+CLIPProcessor = BlipProcessor = _Processor
+CLIPModel = BlipForConditionalGeneration = _Model
+'''
+
+
+def write_stub_models(directory: str):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'sentence_transformers.py'), 'w') as f:
+        f.write(STUB_SENTENCE_TRANSFORMERS)
+    with open(os.path.join(directory, 'transformers.py'), 'w') as f:
+        f.write(STUB_TRANSFORMERS)
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    lines = []
+    while words > 0:
+        n = min(words, rng.randint(6, 16))
+        lines.append(' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.')
+        words -= n
+    return '\n'.join(lines)
+
+
+def make_corpus(root: str, files: int, dirs: int, rng: random.Random):
+    """Write `files` .txt files over `dirs` nested folders; returns (subdirs, paths)."""
+    subdirs = [os.path.join(root, f'd{i // 10}', f'd{i}') for i in range(dirs)]
+    for d in subdirs:
+        os.makedirs(d, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = os.path.join(subdirs[i % dirs], f'doc_{i}.txt')
+        with open(path, 'w') as f:
+            f.write(random_text(rng, rng.randint(40, 600)))
+        paths.append(path)
+    return subdirs, paths
+
+
+def make_image_index(cache_dir: str, subdirs, images: int, rng: random.Random):
+    """Synthetic image index (random unit vectors); search only needs the cache, not the pixels."""
+    import numpy as np
+    sys.path.insert(0, BACKEND_DIR)
+    from segmentStore import SegmentStore
+    np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    image_paths, image_to_region, rows = [], [], 0
+    for i in range(images):
+        image_paths.append(os.path.join(subdirs[i % len(subdirs)], f'img_{i}.jpg'))
+        regions = int(np_rng.integers(1, 6))
+        image_to_region.extend((i, r) for r in range(regions))
+        rows += regions
+    embeddings = np_rng.standard_normal((rows, 512)).astype('float32')
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    captions = [' '.join(rng.choice(WORDS) for _ in range(5)) for _ in range(rows)]
+    SegmentStore(os.path.join(cache_dir, 'image_index_cache')).append(embeddings, captions, image_to_region, image_paths)
+    return image_paths
+
+
+def make_query_mix(root: str, subdirs, count: int, image_share: float, rng: random.Random):
+    queries = []
+    for _ in range(count):
+        scope = rng.random()
+        path = root if scope < 0.4 else (os.path.dirname(rng.choice(subdirs)) if scope < 0.7 else rng.choice(subdirs))
+        kind = 'image' if rng.random() < image_share else rng.choice(['text', 'text', 'all'])
+        queries.append({"query": ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))),
+                        "path": path, "type": kind})
+    return queries
+
+
+class Mutator(threading.Thread):
+    """Edits, creates and deletes corpus files so concurrent searches must update the cache."""
+
+    def __init__(self, subdirs, known_paths, interval: float, rng: random.Random):
+        super().__init__(name='corpus-mutator', daemon=True)
+        self.subdirs = subdirs
+        self.known_paths = known_paths
+        self.interval = interval
+        self.rng = rng
+        self.created = []
+        self.stop_event = threading.Event()
+        self.mutations = 0
+
+    def run(self):
+        counter = 0
+        while not self.stop_event.wait(self.interval):
+            action = self.rng.random()
+            try:
+                if action < 0.5:
+                    with open(self.rng.choice(sorted(self.known_paths)), 'a') as f:
+                        f.write('\n' + random_text(self.rng, 30))
+                elif action < 0.8 or not self.created:
+                    path = os.path.join(self.rng.choice(self.subdirs), f'new_{counter}.txt')
+                    counter += 1
+                    self.known_paths.add(path)
+                    with open(path, 'w') as f:
+                        f.write(random_text(self.rng, 200))
+                    self.created.append(path)
+                else:
+                    os.remove(self.created.pop(self.rng.randrange(len(self.created))))
+                self.mutations += 1
+            except OSError:
+                pass
+
+
+def run_cli_request(request, workdir: str, env, budget):
+    args = [sys.executable, SEARCH_SCRIPT, request['path'], request['query']]
+    if budget is not None:
+        args.append(str(budget))
+    start = time.perf_counter()
+    proc = subprocess.run(args, cwd=workdir, env=env, capture_output=True, text=True)
+    latency = time.perf_counter() - start
+    cache_warnings = [line for line in proc.stderr.splitlines() if any(m in line for m in CACHE_READ_FAILURES)]
+    if proc.returncode != 0:
+        return latency, None, (proc.stderr.strip().splitlines() or ['exit %d' % proc.returncode])[-1], cache_warnings
+    try:
+        return latency, json.loads(proc.stdout), None, cache_warnings
+    except ValueError as e:
+        return latency, None, f"unparseable output: {e}", cache_warnings
+
+
+class _StderrCapture:
+    """Per-thread copy of stderr lines, so in-process requests can be checked like CLI ones."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        lines = getattr(self.local, 'lines', None)
+        if lines is not None:
+            lines.append(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def start(self):
+        self.local.lines = []
+
+    def stop(self):
+        lines, self.local.lines = self.local.lines, None
+        return ''.join(lines).splitlines()
+
+
+def run_inprocess_request(request, search_module, capture: _StderrCapture, budget):
+    capture.start()
+    start = time.perf_counter()
+    try:
+        result = search_module.run_method('search', request['path'], request['query'], request['type'],
+                                          budget_seconds=budget)
+        json.dumps(result)
+        error = result.get('error')
+    except Exception:
+        result, error = None, traceback.format_exc().strip().splitlines()[-1]
+    latency = time.perf_counter() - start
+    cache_warnings = [line for line in capture.stop() if any(m in line for m in CACHE_READ_FAILURES)]
+    return latency, result, error, cache_warnings
+
+
+def check_cache(cache_dir: str):
+    """Invariants of the on-disk indexes; returns a list of problems (empty if consistent)."""
+    import numpy as np
+    sys.path.insert(0, BACKEND_DIR)
+    import semanticSearch
+    problems = []
+    text_dir = os.path.join(cache_dir, 'text_index_cache')
+    if os.path.isdir(text_dir):
+        (embeddings_np, index, keyword_index, file_paths, file_stats,
+         passage_files, passage_offsets, path_index, projection) = semanticSearch.load_text_index(text_dir)
+        if index is None:
+            problems.append("text index cache exists but cannot be loaded")
+        else:
+            rows = index.ntotal
+            if not (rows == len(embeddings_np) == len(passage_files) == len(passage_offsets) == keyword_index.num_docs):
+                problems.append(f"text index row counts disagree: index={rows} embeddings={len(embeddings_np)} "
+                                f"passages={len(passage_files)} bm25={keyword_index.num_docs}")
+            if len(file_paths) != len(file_stats):
+                problems.append("text index file_paths and file_stats differ in length")
+            if len(passage_files) and int(passage_files.max()) >= len(file_paths):
+                problems.append("text passages point past the file list")
+            elif any(file_stats[i] is None for i in np.unique(passage_files).tolist()):
+                problems.append("text passages of deleted or replaced files are still loaded")
+            live_paths = [p for p, stat in zip(file_paths, file_stats) if stat is not None]
+            if len(set(live_paths)) != len(live_paths):
+                problems.append("text index lists a live file more than once")
+            if path_index.ends.size and int(path_index.ends.max()) != rows:
+                problems.append("text path index does not cover the index rows")
+    image_dir = os.path.join(cache_dir, 'image_index_cache')
+    if os.path.isdir(image_dir):
+        embeddings_np, index, captions, image_to_region, image_paths, _ = semanticSearch.load_embeddings_captions(image_dir)
+        if index is None:
+            problems.append("image index cache exists but cannot be loaded")
+        elif not (index.ntotal == len(captions) == len(image_to_region)):
+            problems.append("image index row counts disagree")
+        elif image_to_region and max(img for img, _ in image_to_region) >= len(image_paths):
+            problems.append("image regions point past the image list")
+    return problems
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def peak_rss_mb(who) -> float:
+    rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent load test for semanticSearch.py")
+    parser.add_argument('--mode', choices=['cli', 'inprocess'], default='cli',
+                        help="one semanticSearch.py process per request, or run_method() on threads")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--files', type=int, default=500, help="synthetic text files")
+    parser.add_argument('--dirs', type=int, default=40)
+    parser.add_argument('--images', type=int, default=0, help="synthetic entries in the image index")
+    parser.add_argument('--image-share', type=float, default=0.0, help="fraction of image-only queries (inprocess)")
+    parser.add_argument('--mutate-interval', type=float, default=0.0,
+                        help="seconds between corpus edits during the run; 0 disables")
+    parser.add_argument('--budget', type=float, default=None, help="latency budget passed to each search")
+    parser.add_argument('--no-warmup', action='store_true',
+                        help="skip the untimed request that builds the index first (a cold cache then "
+                             "shows up as cache read failures)")
+    parser.add_argument('--stub-models', action='store_true', help="offline hashing models instead of MiniLM/CLIP/BLIP")
+    parser.add_argument('--workdir', default=None, help="scratch directory (default: a new temp dir, removed after)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', default=None, help="also write the report here")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='fileai_load_'))
+    corpus = os.path.join(workdir, 'corpus')
+    cache_dir = os.path.join(workdir, '.cache_fileai')
+    env = dict(os.environ)
+    if args.stub_models:
+        stub_dir = os.path.join(workdir, 'stub_models')
+        write_stub_models(stub_dir)
+        sys.path.insert(0, stub_dir)
+        env['PYTHONPATH'] = os.pathsep.join(p for p in (stub_dir, env.get('PYTHONPATH')) if p)
+
+    print(f"[INFO] Writing {args.files} files to {corpus}...", file=sys.stderr)
+    subdirs, paths = make_corpus(corpus, args.files, args.dirs, rng)
+    known_paths = set(paths)
+    if args.images:
+        known_paths.update(make_image_index(cache_dir, subdirs, args.images, rng))
+    queries = make_query_mix(corpus, subdirs, args.requests, args.image_share, rng)
+    if args.mode == 'cli':
+        # The CLI entry point always searches text and images together.
+        for q in queries:
+            q['type'] = 'all'
+
+    # semanticSearch keeps its cache relative to the working directory.
+    os.chdir(workdir)
+    search_module, capture = None, None
+    if args.mode == 'inprocess':
+        sys.path.insert(0, BACKEND_DIR)
+        import semanticSearch as search_module
+        search_module.CACHE_DIR = cache_dir
+        capture = _StderrCapture(sys.stderr)
+        sys.stderr = capture
+
+    def run_one(request):
+        if args.mode == 'cli':
+            return run_cli_request(request, workdir, env, args.budget)
+        return run_inprocess_request(request, search_module, capture, args.budget)
+
+    if not args.no_warmup:
+        print("[INFO] Warm-up request...", file=sys.stderr)
+        run_one({"query": "warm up", "path": corpus, "type": "all"})
+
+    mutator = None
+    if args.mutate_interval > 0:
+        mutator = Mutator(subdirs, known_paths, args.mutate_interval, rng)
+        mutator.start()
+
+    print(f"[INFO] {args.requests} requests at concurrency {args.concurrency} ({args.mode})...", file=sys.stderr)
+    latencies, errors, cache_warnings, bad_results, partial = [], [], [], [], 0
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for request, (latency, result, error, warnings) in zip(queries, pool.map(run_one, queries)):
+            latencies.append(latency)
+            cache_warnings.extend(warnings)
+            if error is not None:
+                errors.append({"request": request, "error": error})
+                continue
+            partial += bool(result.get('partial'))
+            for hit in result.get('text_results', []) + result.get('image_results', []):
+                if hit['file_path'] not in known_paths:
+                    bad_results.append({"request": request, "file_path": hit['file_path']})
+    elapsed = time.perf_counter() - start
+    if mutator is not None:
+        mutator.stop_event.set()
+        mutator.join()
+    if capture is not None:
+        sys.stderr = capture.stream
+
+    problems = check_cache(cache_dir)
+    report = {
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "files": args.files,
+        "mutations": mutator.mutations if mutator is not None else 0,
+        "latency_s": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                      "p99": percentile(latencies, 99), "max": max(latencies) if latencies else float('nan')},
+        "throughput_rps": args.requests / elapsed if elapsed > 0 else float('nan'),
+        "peak_rss_mb": {"harness": peak_rss_mb(resource.RUSAGE_SELF),
+                        "largest_child": peak_rss_mb(resource.RUSAGE_CHILDREN)},
+        "partial_responses": partial,
+        "errors": errors,
+        "cache_read_failures": cache_warnings,
+        "results_for_unknown_files": bad_results,
+        "cache_problems": problems,
+    }
+    races = len(errors) + len(cache_warnings) + len(bad_results) + len(problems)
+
+    lat = report["latency_s"]
+    print(f"latency  p50 {lat['p50']:.3f}s  p95 {lat['p95']:.3f}s  p99 {lat['p99']:.3f}s  max {lat['max']:.3f}s")
+    print(f"throughput {report['throughput_rps']:.2f} req/s over {elapsed:.1f}s, "
+          f"{report['partial_responses']} partial, {report['mutations']} corpus edits")
+    print(f"peak RSS harness {report['peak_rss_mb']['harness']:.0f} MB, "
+          f"largest child {report['peak_rss_mb']['largest_child']:.0f} MB")
+    print(f"errors {len(errors)}, cache read failures {len(cache_warnings)}, "
+          f"results for unknown files {len(bad_results)}, cache invariant violations {len(problems)}")
+    for item in (errors[:5] + [{"cache_read_failure": w} for w in cache_warnings[:5]] + bad_results[:5]
+                 + [{"cache_problem": p} for p in problems]):
+        print(f"  {json.dumps(item)}")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if races else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
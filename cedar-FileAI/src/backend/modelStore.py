@@ -0,0 +1,268 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+
+# Bump whenever a pin below changes, so weights fetched under old pins are never loaded.
+MODEL_STORE_VERSION = 2
+MODEL_STORE_DIR = os.environ.get("FILEAI_MODEL_STORE",
+                                 os.path.join(os.path.expanduser("~"), ".cache", "fileai", "models"))
+MANIFEST_FILE = "manifest.json"
+
+YOLO_REPO = "ultralytics/yolov5"
+# Release tag pinning both the hubconf code and the yolov5s.pt asset.
+YOLO_TAG = "v7.0"
+YOLO_WEIGHTS = "yolov5s.pt"
+CLIP_MODEL_ID = "openai/clip-vit-base-patch32"
+BLIP_MODEL_ID = "Salesforce/blip-image-captioning-base"
+TEXT_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+# Hub commit fetched per model. Branch names would move under us, so these are commit
+# SHAs, and prefetch fails if the hub resolves one to anything else.
+HF_REVISIONS = {
+    "clip": "3d74acf9a28c67741b2f4f2ea7635f0aaf6f0268",
+    "blip": "82a37760796d32b1411fe092ab5d4e227313294b",
+    "minilm": "c9745ed1d9f207416be6d2e6f8de32d1f16199bf",
+}
+MODEL_NAMES = ("yolov5", "clip", "blip", "minilm")
+
+# Seconds spent in each load_* call of this process, for the cold-start report.
+LOAD_SECONDS: Dict[str, float] = {}
+_warned = set()
+
+
+def store_dir() -> str:
+    return os.path.join(MODEL_STORE_DIR, f"v{MODEL_STORE_VERSION}")
+
+
+def _manifest() -> dict:
+    try:
+        with open(os.path.join(store_dir(), MANIFEST_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _record(name: str, entry: dict):
+    manifest = _manifest()
+    manifest[name] = entry
+    path = os.path.join(store_dir(), MANIFEST_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def stored(name: str) -> Optional[dict]:
+    """Manifest entry of a model whose files are in the store, or None."""
+    entry = _manifest().get(name)
+    if entry and os.path.isdir(os.path.join(store_dir(), name)):
+        return entry
+    return None
+
+
+def _missing(name: str):
+    if name not in _warned:
+        _warned.add(name)
+        print(f"[WARNING] {name} is not in the model store at {store_dir()}; downloading it. "
+              f"Run `python modelStore.py prefetch` once to load models offline.", file=sys.stderr)
+
+
+def _fast_init_kwargs() -> dict:
+    # Skips random weight init before the (memory-mapped) safetensors are loaded; needs accelerate.
+    return {"low_cpu_mem_usage": True} if importlib.util.find_spec("accelerate") else {}
+
+
+def _timed(name: str, start: float, source: str):
+    LOAD_SECONDS[name] = time.perf_counter() - start
+    print(f"[INFO] Loaded {name} from {source} in {LOAD_SECONDS[name]:.2f}s", file=sys.stderr)
+
+
+# Loaders: read from the store with no network access, or fall back to the hubs if not prefetched.
+def load_yolo(device):
+    import torch
+    start = time.perf_counter()
+    entry = stored("yolov5")
+    if entry is None:
+        _missing("yolov5")
+        model = torch.hub.load(YOLO_REPO, "yolov5s", pretrained=True)
+    else:
+        dest = os.path.join(store_dir(), "yolov5")
+        model = torch.hub.load(os.path.join(dest, entry["repo_dir"]), "custom",
+                               path=os.path.join(dest, YOLO_WEIGHTS), source="local")
+    model = model.to(device)
+    model.eval()
+    _timed("yolov5", start, "the model store" if entry else "the hub")
+    return model
+
+
+def _load_hf(name: str, model_id: str, processor_cls, model_cls, device):
+    start = time.perf_counter()
+    entry = stored(name)
+    if entry is None:
+        _missing(name)
+        proc = processor_cls.from_pretrained(model_id)
+        model = model_cls.from_pretrained(model_id)
+    else:
+        dest = os.path.join(store_dir(), name)
+        proc = processor_cls.from_pretrained(dest, local_files_only=True)
+        model = model_cls.from_pretrained(dest, local_files_only=True, **_fast_init_kwargs())
+    model = model.to(device)
+    model.eval()
+    _timed(name, start, "the model store" if entry else "the hub")
+    return proc, model
+
+
+def load_clip(device):
+    from transformers import CLIPModel, CLIPProcessor
+    return _load_hf("clip", CLIP_MODEL_ID, CLIPProcessor, CLIPModel, device)
+
+
+def load_blip(device):
+    from transformers import BlipForConditionalGeneration, BlipProcessor
+    return _load_hf("blip", BLIP_MODEL_ID, BlipProcessor, BlipForConditionalGeneration, device)
+
+
+def load_text_model(device=None):
+    from sentence_transformers import SentenceTransformer
+    start = time.perf_counter()
+    entry = stored("minilm")
+    if entry is None:
+        _missing("minilm")
+        model = SentenceTransformer(TEXT_MODEL_ID, device=device)
+    else:
+        model = SentenceTransformer(os.path.join(store_dir(), "minilm"), device=device)
+    _timed("minilm", start, "the model store" if entry else "the hub")
+    return model
+
+
+# Prefetch: the only step that touches the network.
+def _prefetch_yolo(dest: str) -> dict:
+    import torch
+    previous = torch.hub.get_dir()
+    # The pinned hubconf checkout lands in dest, and custom() downloads the release asset to path.
+    torch.hub.set_dir(dest)
+    try:
+        torch.hub.load(f"{YOLO_REPO}:{YOLO_TAG}", "custom", path=os.path.join(dest, YOLO_WEIGHTS),
+                       trust_repo=True)
+    finally:
+        torch.hub.set_dir(previous)
+    repo_dir = f"{YOLO_REPO.replace('/', '_')}_{YOLO_TAG}"
+    return {"source": YOLO_REPO, "revision": YOLO_TAG, "repo_dir": repo_dir}
+
+
+def _checked_commit(name: str, config) -> Optional[str]:
+    # The commit transformers actually loaded; None on versions that do not report it.
+    commit = getattr(config, "_commit_hash", None)
+    if commit is not None and commit != HF_REVISIONS[name]:
+        raise RuntimeError(f"{name}: the hub resolved pinned revision {HF_REVISIONS[name]} to {commit}")
+    return commit
+
+
+def _prefetch_hf(name: str, model_id: str, processor_cls, model_cls, dest: str) -> dict:
+    revision = HF_REVISIONS[name]
+    model = model_cls.from_pretrained(model_id, revision=revision)
+    commit = _checked_commit(name, model.config)
+    # Re-saved as safetensors, which from_pretrained memory-maps instead of unpickling.
+    model.save_pretrained(dest, safe_serialization=True)
+    processor_cls.from_pretrained(model_id, revision=revision).save_pretrained(dest)
+    return {"source": model_id, "revision": revision, "commit": commit}
+
+
+def _prefetch_minilm(dest: str) -> dict:
+    from sentence_transformers import SentenceTransformer
+    revision = HF_REVISIONS["minilm"]
+    model = SentenceTransformer(TEXT_MODEL_ID, revision=revision, device="cpu")
+    try:
+        config = model._first_module().auto_model.config
+    except (AttributeError, IndexError):
+        config = None
+    commit = _checked_commit("minilm", config)
+    model.save(dest)
+    return {"source": TEXT_MODEL_ID, "revision": revision, "commit": commit}
+
+
+def prefetch(names: List[str] = MODEL_NAMES, force: bool = False):
+    for name in names:
+        if stored(name) and not force:
+            print(f"[INFO] {name} already in the model store.", file=sys.stderr)
+            continue
+        dest = os.path.join(store_dir(), name)
+        os.makedirs(dest, exist_ok=True)
+        print(f"[INFO] Fetching {name} into {dest}...", file=sys.stderr)
+        if name == "yolov5":
+            entry = _prefetch_yolo(dest)
+        elif name == "clip":
+            from transformers import CLIPModel, CLIPProcessor
+            entry = _prefetch_hf(name, CLIP_MODEL_ID, CLIPProcessor, CLIPModel, dest)
+        elif name == "blip":
+            from transformers import BlipForConditionalGeneration, BlipProcessor
+            entry = _prefetch_hf(name, BLIP_MODEL_ID, BlipProcessor, BlipForConditionalGeneration, dest)
+        elif name == "minilm":
+            entry = _prefetch_minilm(dest)
+        else:
+            raise ValueError(f"unknown model: {name}")
+        entry["fetched_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        _record(name, entry)
+    print(f"[INFO] Model store ready at {store_dir()}", file=sys.stderr)
+
+
+def _time_one(name: str) -> dict:
+    # Runs in a fresh interpreter, so library imports count toward the cold start.
+    start = time.perf_counter()
+    import torch
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if name == "yolov5":
+        load = lambda: load_yolo(device)
+    elif name == "clip":
+        load = lambda: load_clip(device)
+    elif name == "blip":
+        load = lambda: load_blip(device)
+    else:
+        load = lambda: load_text_model(device)
+    imported = time.perf_counter()
+    load()
+    return {"model": name, "source": "store" if stored(name) else "hub",
+            "import_s": imported - start, "load_s": LOAD_SECONDS[name]}
+
+
+def cold_start_report(names: List[str] = MODEL_NAMES) -> List[dict]:
+    """Load each model in a fresh process and time it; failures are reported, not raised."""
+    rows = []
+    for name in names:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "_time", name],
+                              capture_output=True, text=True)
+        try:
+            rows.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        except (IndexError, ValueError):
+            rows.append({"model": name, "error": proc.stderr.strip().splitlines()[-1:] or ["no output"]})
+    return rows
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] not in ("prefetch", "report", "_time"):
+        print("Usage: python modelStore.py prefetch [--force] [model...] | report [--json] [model...]",
+              file=sys.stderr)
+        print(f"Models: {', '.join(MODEL_NAMES)}; store: {store_dir()}", file=sys.stderr)
+        sys.exit(1)
+    command, rest = args[0], args[1:]
+    if command == "_time":
+        print(json.dumps(_time_one(rest[0])))
+    elif command == "prefetch":
+        prefetch([a for a in rest if not a.startswith("--")] or MODEL_NAMES, force="--force" in rest)
+    else:
+        rows = cold_start_report([a for a in rest if not a.startswith("--")] or MODEL_NAMES)
+        if "--json" in rest:
+            print(json.dumps(rows, indent=2))
+        else:
+            print(f"{'model':<8} {'source':<6} {'import_s':>9} {'load_s':>8}")
+            for row in rows:
+                if "error" in row:
+                    print(f"{row['model']:<8} failed: {row['error'][0]}")
+                else:
+                    print(f"{row['model']:<8} {row['source']:<6} {row['import_s']:>9.2f} {row['load_s']:>8.2f}")
+            print(f"total load {sum(r.get('load_s', 0.0) for r in rows):.2f}s")
@@ -0,0 +1,253 @@
+import collections
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Iterable, Iterator, Tuple
+
+from segmentStore import directory_lock
+
+try:
+    import resource
+except ImportError:  # Windows: no per-process address-space limit
+    resource = None
+
+
+PARSE_TIMEOUT_SECONDS = 60
+# Address space a worker may add on top of what it inherited from the parent.
+PARSE_MEMORY_LIMIT_MB = 2048
+PARSE_TASKS_PER_WORKER = 50
+QUARANTINE_AFTER_FAILURES = 2
+
+
+def _address_space_bytes():
+    # VmSize; a forked worker starts with all of the parent's mappings (torch, loaded models).
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _worker_main(conn, parse_fn, memory_limit_mb, max_tasks):
+    inherited = _address_space_bytes()
+    if resource is not None and memory_limit_mb and inherited is not None:
+        limit = inherited + memory_limit_mb * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, OSError):
+            pass
+    for _ in range(max_tasks):
+        try:
+            path = conn.recv()
+        except EOFError:
+            break
+        if path is None:
+            break
+        try:
+            conn.send(("ok", parse_fn(path)))
+        except MemoryError:
+            conn.send(("error", "out of memory"))
+        except Exception as e:
+            conn.send(("error", str(e)))
+    conn.close()
+
+
+def _file_stat(path: str):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+    except OSError:
+        return None
+
+
+class _Worker:
+    def __init__(self, context, parse_fn, memory_limit_mb, max_tasks):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, parse_fn, memory_limit_mb, max_tasks),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks_left = max_tasks
+        self.path = None
+        self.deadline = None
+
+    def assign(self, path: str, timeout: float):
+        self.conn.send(path)
+        self.tasks_left -= 1
+        self.path = path
+        self.deadline = time.monotonic() + timeout
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def retire(self):
+        # The worker exits by itself after its last task; just reap it.
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ParseSupervisor:
+    """
+    Runs `parse_fn(path) -> str` in a small pool of worker processes with a
+    wall-clock limit per file, a cap of memory_limit_mb on the address space each
+    worker grows beyond what it inherited from the parent, and workers
+    replaced after PARSE_TASKS_PER_WORKER files so leaks don't accumulate.
+
+    A file that times out or kills its worker counts as a failure; after
+    QUARANTINE_AFTER_FAILURES failures it goes into a persistent skip list and is
+    not tried again until its mtime or size changes.
+    """
+
+    def __init__(self, parse_fn: Callable[[str], str], quarantine_path: str = None, workers: int = None,
+                 timeout: float = PARSE_TIMEOUT_SECONDS, memory_limit_mb: int = PARSE_MEMORY_LIMIT_MB,
+                 tasks_per_worker: int = PARSE_TASKS_PER_WORKER):
+        self.parse_fn = parse_fn
+        self.quarantine_path = quarantine_path
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.tasks_per_worker = tasks_per_worker
+        # Fork where possible: the parent's imports are shared and parse_fn need not be importable.
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self.quarantine = self._load_quarantine()
+        # Changes since the last save: path -> None (parsed fine) or the failures added here.
+        self._changes = {}
+
+    def _load_quarantine(self):
+        if not self.quarantine_path:
+            return {}
+        try:
+            with open(self.quarantine_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_quarantine(self):
+        # Other processes update the same file: merge our changes into what is on
+        # disk now, under the cache directory's lock, and only if there are any.
+        if not self.quarantine_path or not self._changes:
+            return
+        directory = os.path.dirname(self.quarantine_path) or '.'
+        with directory_lock(directory):
+            quarantine = self._load_quarantine()
+            for path, change in self._changes.items():
+                entry = quarantine.get(path)
+                if change is None:
+                    quarantine.pop(path, None)
+                elif entry is not None and entry['stat'] == change['stat']:
+                    entry['failures'] += change['failures']
+                    entry['reason'] = change['reason']
+                else:
+                    quarantine[path] = dict(change)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.parse_quarantine.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(quarantine, f)
+                os.replace(tmp_path, self.quarantine_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        self.quarantine = quarantine
+        self._changes = {}
+
+    def is_quarantined(self, path: str) -> bool:
+        entry = self.quarantine.get(path)
+        return (entry is not None and entry['failures'] >= QUARANTINE_AFTER_FAILURES
+                and entry['stat'] == _file_stat(path))
+
+    def _record(self, path: str, ok: bool, reason: str = None):
+        if ok:
+            if self.quarantine.pop(path, None) is not None or path in self._changes:
+                self._changes[path] = None
+            return
+        stat = _file_stat(path)
+        entry = self.quarantine.get(path)
+        if entry is None or entry['stat'] != stat:
+            entry = {"failures": 0, "stat": stat}
+        entry['failures'] += 1
+        entry['reason'] = reason
+        self.quarantine[path] = entry
+        change = self._changes.get(path)
+        if change is None or change['stat'] != stat:
+            change = {"failures": 0, "stat": stat}
+        change['failures'] += 1
+        change['reason'] = reason
+        self._changes[path] = change
+        if entry['failures'] >= QUARANTINE_AFTER_FAILURES:
+            print(f"[WARNING] Quarantining {path} after {entry['failures']} failed parses ({reason})", file=sys.stderr)
+
+    def imap(self, paths: Iterable[str], deadline: float = None) -> Iterator[Tuple[str, str, bool]]:
+        """
+        Yield (path, text, ok) in completion order. `ok` is False when the file
+        timed out, crashed its worker or is quarantined; `text` is then "".
+
+        At the monotonic time `deadline` the run stops: files still in flight are
+        abandoned (not counted as failures) and the rest are never yielded.
+        """
+        queue = collections.deque()
+        for path in paths:
+            if self.is_quarantined(path):
+                print(f"[INFO] Skipping quarantined file: {path}", file=sys.stderr)
+                yield path, "", False
+            else:
+                queue.append(path)
+        idle, busy = [], {}
+        try:
+            while queue or busy:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                while queue and len(busy) < self.workers:
+                    worker = idle.pop() if idle else None
+                    if worker is None or worker.tasks_left <= 0:
+                        if worker is not None:
+                            worker.retire()
+                        worker = _Worker(self.context, self.parse_fn, self.memory_limit_mb, self.tasks_per_worker)
+                    worker.assign(queue.popleft(), self.timeout)
+                    busy[worker.conn] = worker
+
+                next_deadline = min(w.deadline for w in busy.values())
+                if deadline is not None:
+                    next_deadline = min(next_deadline, deadline)
+                wait_for = max(0.0, next_deadline - time.monotonic())
+                for conn in multiprocessing.connection.wait(list(busy), timeout=wait_for):
+                    worker = busy.pop(conn)
+                    try:
+                        status, value = conn.recv()
+                    except (EOFError, OSError):
+                        worker.kill()
+                        self._record(worker.path, False, "worker died")
+                        print(f"[WARNING] Parser worker died on {worker.path}", file=sys.stderr)
+                        yield worker.path, "", False
+                        continue
+                    self._record(worker.path, status == "ok", value if status != "ok" else None)
+                    idle.append(worker)
+                    yield worker.path, value if status == "ok" else "", status == "ok"
+
+                now = time.monotonic()
+                for conn, worker in list(busy.items()):
+                    if worker.deadline <= now:
+                        del busy[conn]
+                        worker.kill()
+                        self._record(worker.path, False, f"timed out after {self.timeout}s")
+                        print(f"[WARNING] Parsing {worker.path} timed out after {self.timeout}s", file=sys.stderr)
+                        yield worker.path, "", False
+        finally:
+            for worker in list(busy.values()):
+                worker.kill()
+            for worker in idle:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.retire()
+            self._save_quarantine()
@@ -0,0 +1,118 @@
+import bisect
+import json
+import os
+from typing import Iterable, List, Tuple
+
+import faiss
+import numpy as np
+
+
+# Below this share of the index, a scoped query is answered by brute force over
+# the gathered rows instead of a full-index scan with an ID selector.
+SUBSET_SCAN_FRACTION = 0.25
+
+
+def normalize_path(path: str) -> str:
+    return os.path.normpath(os.path.abspath(path))
+
+
+class PathPrefixIndex:
+    """
+    Sorted file paths with the vector ID range each one owns. Every file under a
+    directory sits in one contiguous slice of the sorted list, so resolving a
+    subtree to its IDs is two binary searches plus the size of the subtree.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, int, int]]):
+        rows = sorted((normalize_path(p), int(start), int(end)) for p, start, end in entries)
+        # Set by callers that persist the index, to recognise the data it was built from.
+        self.signature = None
+        self.paths = [row[0] for row in rows]
+        self.starts = np.array([row[1] for row in rows], dtype=np.int64)
+        self.ends = np.array([row[2] for row in rows], dtype=np.int64)
+
+    @classmethod
+    def from_region_map(cls, image_paths: List[str], image_to_region: List[Tuple[int, int]]):
+        # Region rows of one image are appended together, so each image usually
+        # owns a single run of IDs; a split run just becomes several entries.
+        entries = []
+        run_img, run_start = None, 0
+        for row, (img_idx, _) in enumerate(image_to_region):
+            if img_idx != run_img:
+                if run_img is not None:
+                    entries.append((image_paths[run_img], run_start, row))
+                run_img, run_start = img_idx, row
+        if run_img is not None:
+            entries.append((image_paths[run_img], run_start, len(image_to_region)))
+        return cls(entries)
+
+    @classmethod
+    def from_row_owners(cls, file_paths: List[str], owners: np.ndarray, files=None):
+        # `owners[row]` is the file index of each row and never decreases, so each
+        # file owns one (possibly empty) run of rows. `files` limits the entries to those file indices.
+        owners = np.asarray(owners, dtype=np.int64)
+        files = np.arange(len(file_paths)) if files is None else np.asarray(files, dtype=np.int64)
+        starts = np.searchsorted(owners, files, side='left')
+        ends = np.searchsorted(owners, files, side='right')
+        return cls(zip([file_paths[i] for i in files.tolist()], starts.tolist(), ends.tolist()))
+
+    def _slices(self, path: str) -> List[Tuple[int, int]]:
+        target = normalize_path(path)
+        exact = (bisect.bisect_left(self.paths, target), bisect.bisect_right(self.paths, target))
+        prefix = target if target.endswith(os.sep) else target + os.sep
+        # Every "<dir>/..." path sorts before "<dir>0" since '0' follows the separator.
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        below = (bisect.bisect_left(self.paths, prefix), bisect.bisect_left(self.paths, upper))
+        return [s for s in (exact, below) if s[1] > s[0]]
+
+    def paths_under(self, path: str) -> List[str]:
+        return [p for lo, hi in self._slices(path) for p in self.paths[lo:hi]]
+
+    def ids_under(self, path: str) -> np.ndarray:
+        ranges = []
+        for lo, hi in self._slices(path):
+            for start, end in zip(self.starts[lo:hi], self.ends[lo:hi]):
+                ranges.append(np.arange(start, end, dtype=np.int64))
+        if not ranges:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(ranges))
+
+    def save(self, file_path: str):
+        with open(file_path, 'w') as f:
+            json.dump({"paths": self.paths, "starts": self.starts.tolist(), "ends": self.ends.tolist(),
+                       "signature": self.signature}, f)
+
+    @classmethod
+    def load(cls, file_path: str):
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        index = cls.__new__(cls)
+        index.paths = data["paths"]
+        index.starts = np.array(data["starts"], dtype=np.int64)
+        index.ends = np.array(data["ends"], dtype=np.int64)
+        index.signature = data.get("signature")
+        return index
+
+
+def search_within(index, embeddings_np, query_np: np.ndarray, ids: np.ndarray, k: int):
+    """
+    FAISS-style (distances, indices) search restricted to `ids`. Small subsets are
+    scored directly from their stored rows; larger ones go through an ID selector.
+    """
+    query_np = np.asarray(query_np, dtype=np.float32).reshape(1, -1)
+    k = min(k, int(ids.size))
+    if k <= 0:
+        return np.empty((1, 0), dtype=np.float32), np.empty((1, 0), dtype=np.int64)
+    if embeddings_np is not None and ids.size <= SUBSET_SCAN_FRACTION * index.ntotal:
+        subset = np.asarray(embeddings_np[ids], dtype=np.float32)
+        dists = ((subset - query_np) ** 2).sum(axis=1)
+        top = np.argpartition(dists, k - 1)[:k] if k < dists.size else np.arange(dists.size)
+        top = top[np.argsort(dists[top])]
+        return dists[top][None, :], ids[top][None, :]
+    if ids.size == ids[-1] - ids[0] + 1:
+        selector = faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1)
+    else:
+        selector = faiss.IDSelectorBatch(ids)
+    distances, indices = index.search(query_np, k, params=faiss.SearchParameters(sel=selector))
+    keep = indices[0] >= 0
+    return distances[:, keep], indices[:, keep]
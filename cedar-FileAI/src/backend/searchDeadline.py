@@ -0,0 +1,39 @@
+import math
+import sys
+import time
+from typing import List, Optional
+
+
+class SearchDeadline:
+    """
+    Latency budget for one search request. Stages ask how much time is left
+    (or get an absolute cut-off for their share of the budget) and record what
+    they skipped or truncated, which marks the response as partial.
+    Without a budget nothing ever expires.
+    """
+
+    def __init__(self, budget_seconds: Optional[float] = None):
+        self.budget_seconds = budget_seconds
+        self.start = time.monotonic()
+        self.at = None if budget_seconds is None else self.start + budget_seconds
+        self.skipped: List[str] = []
+
+    def remaining(self) -> float:
+        return math.inf if self.at is None else self.at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def until(self, share: float) -> Optional[float]:
+        """Monotonic time at which `share` of the budget is used up, or None without a budget."""
+        return None if self.at is None else self.start + share * self.budget_seconds
+
+    def skip(self, stage: str):
+        if stage not in self.skipped:
+            print(f"[INFO] Search budget: skipped or cut short {stage} "
+                  f"after {time.monotonic() - self.start:.2f}s", file=sys.stderr)
+            self.skipped.append(stage)
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.skipped)
@@ -0,0 +1,452 @@
+import contextlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from ingestCheckpoint import atomic_write_json
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-writer use only
+    fcntl = None
+
+
+# More live segments than this triggers a background merge into one.
+MAX_SEGMENTS = 8
+COPY_CHUNK_ROWS = 65536
+# Size of the .npy header NpyRowWriter reserves; a multiple of 64 keeps the rows aligned.
+NPY_HEADER_BYTES = 128
+
+MANIFEST_NAME = 'manifest.json'
+# (mtime_ns, size) stored for images whose stats were not recorded.
+UNKNOWN_STAT = (-1, -1)
+LEGACY_FILES = ('image_embeddings.npy', 'index_metadata.json')
+
+
+@contextlib.contextmanager
+def directory_lock(directory: str, shared: bool = False, name: str = '.lock'):
+    """Advisory lock on a cache directory: shared for readers, exclusive for writers."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class _IndexBuffer:
+    """
+    Exposes a flat index's vector storage to numpy. Arrays made from it (and
+    every view of those) keep this object, and so the index, alive as their base.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        address = faiss.rev_swig_ptr(index.get_xb(), 1).__array_interface__['data'][0]
+        self.__array_interface__ = {'shape': (index.ntotal, index.d), 'typestr': '<f4',
+                                    'data': (address, False), 'version': 3}
+
+
+def index_vectors(index) -> np.ndarray:
+    # Shares the index's memory, so it is only valid until the index is added to or shrunk.
+    return np.asarray(_IndexBuffer(index))
+
+
+class StackedRows:
+    """
+    The rows of several (memory-mapped) segment arrays read as one (n, d) array;
+    `rows[i]` is the position of row i in the parts laid end to end. Supports
+    what the search needs: indexing by int, slice or integer array, and np.asarray.
+    """
+
+    def __init__(self, parts, rows: np.ndarray, dim: int):
+        self.parts = list(parts)
+        self.bounds = np.cumsum([0] + [len(part) for part in self.parts])
+        self.rows = rows
+        self.dim = dim
+
+    @property
+    def shape(self):
+        return len(self.rows), self.dim
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _take(self, raw: np.ndarray) -> np.ndarray:
+        out = np.empty((raw.size, self.dim), dtype='float32')
+        part_of = np.searchsorted(self.bounds, raw, side='right') - 1
+        for part in np.unique(part_of).tolist():
+            mask = part_of == part
+            out[mask] = self.parts[part][raw[mask] - self.bounds[part]]
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._take(self.rows[[key]])[0]
+        return self._take(np.asarray(self.rows[key]).reshape(-1))
+
+    def __array__(self, dtype=None, copy=None):
+        out = self._take(self.rows)
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def delete(self, positions) -> 'StackedRows':
+        return StackedRows(self.parts, np.delete(self.rows, positions), self.dim)
+
+    def append(self, part) -> 'StackedRows':
+        added = self.bounds[-1] + np.arange(len(part), dtype=np.int64)
+        return StackedRows(self.parts + [part], np.concatenate([self.rows, added]), self.dim)
+
+
+def pool_regions(embeddings_np, region_images: np.ndarray, image_count: int) -> np.ndarray:
+    """
+    One vector per image: the normalized mean of its region rows (zeros for an
+    image without regions). `region_images[row]` is the image of each row.
+    """
+    pooled = np.zeros((image_count, embeddings_np.shape[1]), dtype=np.float32)
+    for start in range(0, len(region_images), COPY_CHUNK_ROWS):
+        images = region_images[start:start + COPY_CHUNK_ROWS]
+        # Rows of one image are adjacent, so each run is summed in one reduceat step.
+        runs = np.flatnonzero(np.concatenate(([True], images[1:] != images[:-1])))
+        chunk = np.asarray(embeddings_np[start:start + len(images)], dtype=np.float32)
+        np.add.at(pooled, images[runs], np.add.reduceat(chunk, runs, axis=0))
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return pooled / np.maximum(norms, 1e-12)
+
+
+def write_npy_atomic(file_path: str, array: np.ndarray):
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def _npy_header(rows: int, dim: int) -> bytes:
+    # Version 1.0 header padded to a fixed size, so it can be rewritten in place.
+    header = repr({'descr': '<f4', 'fortran_order': False, 'shape': (rows, dim)})
+    header = header.ljust(NPY_HEADER_BYTES - 11) + '\n'
+    return np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class NpyRowWriter:
+    """
+    Appends float32 rows to a .npy whose row count is not known up front. Rows
+    go straight to `file_path`.tmp behind a placeholder header; close() writes
+    the final shape into it and moves the file into place, and abort() drops it.
+    """
+
+    def __init__(self, file_path: str, dim: int):
+        self.file_path = file_path
+        self.dim = dim
+        self.rows = 0
+        self._tmp_path = file_path + '.tmp'
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(_npy_header(0, dim))
+
+    def append(self, rows: np.ndarray):
+        rows = np.ascontiguousarray(rows, dtype='<f4').reshape(-1, self.dim)
+        self._file.write(memoryview(rows).cast('B'))
+        self.rows += rows.shape[0]
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(_npy_header(self.rows, self.dim))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.file_path)
+
+    def abort(self):
+        self._file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._tmp_path)
+
+
+def write_npz_atomic(file_path: str, **arrays):
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class SegmentStore:
+    """
+    Append-only image index storage.
+
+    Every batch of new images becomes one immutable segment: a .npy of its
+    embeddings (memory-mapped on load) and an .npz of its captions, (local
+    img_idx, region_idx) pairs, image paths and the (mtime_ns, size) each image
+    had when it was embedded, plus each image's pooled vector (see
+    pool_regions) for the first stage of image search. An image that appears
+    in a later segment supersedes its rows in earlier ones. The
+    only mutable file is a small manifest listing the live segments in order; it
+    is replaced atomically under a lock, so a write costs O(batch) and a crash
+    leaves either the old or the new manifest, never a half-written cache.
+    compact() merges segments into one and runs in a background thread once
+    there are more than MAX_SEGMENTS of them.
+
+    A directory holding only the old single-file cache (image_embeddings.npy +
+    index_metadata.json) is still readable and is turned into the first
+    segment on the first append. Images from it, or from segments written
+    before stats were kept, have unknown stats; segments written before the
+    embeddings moved to their own .npy still hold them in the .npz, and their
+    pooled vectors are computed when they are read.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, MANIFEST_NAME)
+
+    def _locked(self):
+        return directory_lock(self.store_dir)
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _has_legacy(self) -> bool:
+        return all(os.path.exists(os.path.join(self.store_dir, name)) for name in LEGACY_FILES)
+
+    def _load_legacy(self):
+        embeddings_np = np.load(os.path.join(self.store_dir, 'image_embeddings.npy'))
+        with open(os.path.join(self.store_dir, 'index_metadata.json'), 'r') as f:
+            meta = json.load(f)
+        return embeddings_np, meta['captions'], [tuple(pair) for pair in meta['image_to_region']], meta['image_paths']
+
+    def _write_segment(self, embeddings_np, captions, image_to_region, image_paths, image_stats=None) -> dict:
+        name = f"seg_{time.time_ns()}_{os.getpid()}"
+        embeddings_np = np.ascontiguousarray(embeddings_np, dtype='float32')
+        write_npy_atomic(os.path.join(self.store_dir, name + '.npy'), embeddings_np)
+        regions = np.array(image_to_region, dtype=np.int64).reshape(-1, 2)
+        pooled = pool_regions(embeddings_np, regions[:, 0], len(image_paths))
+        return self._write_segment_meta(name, captions, regions, image_paths, pooled, image_stats)
+
+    def _write_segment_meta(self, name, captions, image_to_region, image_paths, pooled, image_stats=None) -> dict:
+        # Everything but the embeddings, which are already in `name`.npy.
+        if image_stats is None:
+            image_stats = [UNKNOWN_STAT] * len(image_paths)
+        write_npz_atomic(
+            os.path.join(self.store_dir, name + '.npz'),
+            captions=np.array(captions, dtype=str),
+            regions=np.array(image_to_region, dtype=np.int64).reshape(-1, 2),
+            image_paths=np.array(image_paths, dtype=str),
+            image_stats=np.array(image_stats, dtype=np.int64).reshape(-1, 2),
+            pooled=np.asarray(pooled, dtype='float32'),
+        )
+        return {"file": name + '.npz', "embeddings": name + '.npy', "rows": len(captions), "images": len(image_paths)}
+
+    def append(self, embeddings_np, captions, image_to_region, image_paths, image_stats=None):
+        """
+        Add a batch; `image_to_region` indexes into this batch's `image_paths`, and
+        `image_stats` holds each image's (mtime_ns, size). Images without any
+        region (the ones that failed to embed) are not recorded, so they are
+        retried next time.
+        """
+        used = sorted({img_idx for img_idx, _ in image_to_region})
+        if len(used) < len(image_paths):
+            renumber = {img_idx: new for new, img_idx in enumerate(used)}
+            image_to_region = [(renumber[img_idx], region_idx) for img_idx, region_idx in image_to_region]
+            image_paths = [image_paths[img_idx] for img_idx in used]
+            if image_stats is not None:
+                image_stats = [image_stats[img_idx] for img_idx in used]
+        if not image_paths:
+            return
+        os.makedirs(self.store_dir, exist_ok=True)
+        segment = self._write_segment(embeddings_np, captions, image_to_region, image_paths, image_stats)
+        with self._locked():
+            manifest = self.read_manifest()
+            if manifest is None:
+                manifest = {"segments": []}
+                if self._has_legacy():
+                    print("[INFO] Converting single-file image cache into the first segment...", file=sys.stderr)
+                    manifest["segments"].append(self._write_segment(*self._load_legacy()))
+            manifest["segments"].append(segment)
+            atomic_write_json(self.manifest_path, manifest)
+        if len(manifest["segments"]) > MAX_SEGMENTS:
+            self.compact_in_background()
+
+    def _segment_images(self, segment):
+        data = np.load(os.path.join(self.store_dir, segment['file']))
+        paths = data['image_paths'].tolist()
+        if 'image_stats' in data.files:
+            return paths, data['image_stats']
+        return paths, np.full((len(paths), 2), UNKNOWN_STAT[0], dtype=np.int64)
+
+    def _segment_files(self, segment):
+        return [segment['file']] + ([segment['embeddings']] if 'embeddings' in segment else [])
+
+    def _read_segments(self, segments):
+        """
+        Yield (embeddings, rows, captions, regions, image_paths, image_stats, pooled)
+        per segment with the rows of superseded images left out and image indices
+        renumbered. `embeddings` holds every stored row (memory-mapped where the
+        segment has a .npy) and `rows` the positions of the kept ones.
+        """
+        images = [self._segment_images(segment) for segment in segments]
+        latest = {path: position for position, (paths, _) in enumerate(images) for path in paths}
+        for position, segment in enumerate(segments):
+            data = np.load(os.path.join(self.store_dir, segment['file']))
+            if 'embeddings' in segment:
+                emb = np.load(os.path.join(self.store_dir, segment['embeddings']), mmap_mode='r')
+            else:
+                emb = data['embeddings']
+            caps, regions = data['captions'], data['regions'].reshape(-1, 2)
+            paths, stats = images[position]
+            live = np.array([latest[path] == position for path in paths], dtype=bool)
+            pooled = data['pooled'] if 'pooled' in data.files else None
+            rows = np.arange(len(caps))
+            if not live.all():
+                renumber = np.cumsum(live) - 1
+                rows = np.flatnonzero(live[regions[:, 0]]) if regions.size else np.zeros(0, dtype=np.int64)
+                caps = caps[rows]
+                regions = np.stack([renumber[regions[rows, 0]], regions[rows, 1]], axis=1)
+                paths = [path for path, keep in zip(paths, live) if keep]
+                stats = stats[live]
+                pooled = pooled[live] if pooled is not None else None
+            if pooled is None:
+                pooled = pool_regions(StackedRows([emb], rows, emb.shape[1]), regions[:, 0], len(paths))
+            yield emb, rows, caps.tolist(), [tuple(r) for r in regions.tolist()], paths, stats, pooled
+
+    def load(self, projection=None):
+        """
+        Returns (embeddings_np, index, captions, image_to_region, image_paths,
+        pooled_np) for the whole store, or Nones if it is empty; pooled_np holds
+        one stored vector per image. Segments are added to the FAISS
+        index one at a time and embeddings_np is a view of the index's own
+        storage (which keeps the index alive), so the vectors are held in memory once.
+
+        With a VectorProjection the index holds the projected vectors instead and
+        embeddings_np reads the full ones, for re-scoring, from the memory-mapped
+        segments rather than keeping a second copy in memory.
+        """
+        for attempt in range(3):
+            manifest = self.read_manifest()
+            if manifest is None:
+                if not self._has_legacy():
+                    return None, None, None, None, None, None
+                embeddings_np, captions, image_to_region, image_paths = self._load_legacy()
+                if projection is not None:
+                    index = projection.build_index(embeddings_np)
+                else:
+                    index = faiss.IndexFlatL2(embeddings_np.shape[1])
+                    index.add(np.ascontiguousarray(embeddings_np, dtype='float32'))
+                region_images = np.array([img_idx for img_idx, _ in image_to_region], dtype=np.int64)
+                pooled_np = pool_regions(embeddings_np, region_images, len(image_paths))
+                return embeddings_np, index, captions, image_to_region, image_paths, pooled_np
+            try:
+                return self._load_segments(manifest["segments"], projection)
+            except FileNotFoundError:
+                # A compaction swapped the manifest and removed segments under us; re-read it.
+                continue
+        raise RuntimeError(f"Segment store {self.store_dir} kept changing while loading")
+
+    def _load_segments(self, segments, projection=None):
+        index = None
+        parts, raw_rows = [], []
+        raw_base = 0
+        captions, image_to_region, image_paths, pooled = [], [], [], []
+        for emb, rows, caps, regions, paths, _, segment_pooled in self._read_segments(segments):
+            if index is None:
+                index = faiss.IndexFlatL2(emb.shape[1] if projection is None else projection.dim_out)
+            for start in range(0, rows.size, COPY_CHUNK_ROWS):
+                chunk = emb[rows[start:start + COPY_CHUNK_ROWS]]
+                if projection is None:
+                    index.add(np.ascontiguousarray(chunk, dtype='float32'))
+                else:
+                    index.add(projection.apply(chunk))
+            if projection is not None:
+                parts.append(emb)
+                raw_rows.append(raw_base + rows)
+                raw_base += emb.shape[0]
+            base = len(image_paths)
+            image_to_region.extend((base + img_idx, region_idx) for img_idx, region_idx in regions)
+            captions.extend(caps)
+            image_paths.extend(paths)
+            pooled.append(segment_pooled)
+        if index is None or index.ntotal == 0:
+            return None, None, None, None, None, None
+        pooled_np = np.vstack(pooled)
+        if projection is not None:
+            full = StackedRows(parts, np.concatenate(raw_rows), parts[0].shape[1])
+            return full, index, captions, image_to_region, image_paths, pooled_np
+        return index_vectors(index), index, captions, image_to_region, image_paths, pooled_np
+
+    def compact(self):
+        """Merge the current segments into one; segments appended meanwhile are kept after it."""
+        manifest = self.read_manifest()
+        if manifest is None or len(manifest["segments"]) < 2:
+            return
+        merged = manifest["segments"]
+        reads = list(self._read_segments(merged))
+        total = sum(rows.size for _, rows, *_ in reads)
+        # The embeddings are streamed into the new segment's .npy rather than stacked in memory.
+        name = f"seg_{time.time_ns()}_{os.getpid()}"
+        tmp_path = os.path.join(self.store_dir, name + '.npy.tmp')
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype='float32', shape=(total, reads[0][0].shape[1]))
+        captions, image_to_region, image_paths, image_stats, pooled = [], [], [], [], []
+        row = 0
+        for emb, rows, caps, regions, paths, stats, segment_pooled in reads:
+            for start in range(0, rows.size, COPY_CHUNK_ROWS):
+                chunk = rows[start:start + COPY_CHUNK_ROWS]
+                out[row:row + chunk.size] = emb[chunk]
+                row += chunk.size
+            base = len(image_paths)
+            image_to_region.extend((base + img_idx, region_idx) for img_idx, region_idx in regions)
+            captions.extend(caps)
+            image_paths.extend(paths)
+            image_stats.append(stats)
+            pooled.append(segment_pooled)
+        out.flush()
+        del out
+        os.replace(tmp_path, os.path.join(self.store_dir, name + '.npy'))
+        segment = self._write_segment_meta(name, captions, image_to_region, image_paths, np.vstack(pooled),
+                                           np.vstack(image_stats))
+        with self._locked():
+            current = self.read_manifest()
+            merged_files = [s["file"] for s in merged]
+            if [s["file"] for s in current["segments"][:len(merged)]] != merged_files:
+                # Another compaction won the race; drop ours.
+                for file_name in self._segment_files(segment):
+                    os.remove(os.path.join(self.store_dir, file_name))
+                return
+            current["segments"] = [segment] + current["segments"][len(merged):]
+            atomic_write_json(self.manifest_path, current)
+        # Readers that already mapped a removed .npy keep a valid mapping.
+        for file_name in (file_name for s in merged for file_name in self._segment_files(s)):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.store_dir, file_name))
+        print(f"[INFO] Compacted {len(merged)} image index segments into one.", file=sys.stderr)
+
+    def compact_in_background(self) -> threading.Thread:
+        # Not a daemon: a short-lived CLI run finishes its compaction before exiting.
+        thread = threading.Thread(target=self.compact, name='segment-compaction')
+        thread.start()
+        return thread
+
+    def image_stats(self) -> Dict[str, Optional[Tuple[int, int]]]:
+        """Live image path -> the (mtime_ns, size) it was embedded at, or None if unknown."""
+        manifest = self.read_manifest()
+        if manifest is None:
+            return dict.fromkeys(self._load_legacy()[3]) if self._has_legacy() else {}
+        stats = {}
+        for segment in manifest["segments"]:
+            paths, segment_stats = self._segment_images(segment)
+            for path, (mtime_ns, size) in zip(paths, segment_stats.tolist()):
+                stats[path] = None if mtime_ns == UNKNOWN_STAT[0] else (mtime_ns, size)
+        return stats
@@ -1,19 +1,32 @@
+import functools
 import os
 import time
-from typing import List, Tuple
-from sentence_transformers import SentenceTransformer
+from typing import List, Optional, Tuple
 import faiss
 import numpy as np
 from striprtf.striprtf import rtf_to_text
 import subprocess
 from PIL import Image
 import torch
-from transformers import CLIPProcessor, CLIPModel
-from transformers import BlipProcessor, BlipForConditionalGeneration
 import re
-import concurrent.futures
 import json
 import sys
+import zlib
+from fileScanner import IMAGE_EXTENSIONS, TEXT_EXTENSIONS, scan_files
+from imageIndex import ImageRegionIndex
+from imageWorkers import ForkedImageWorkers, note_inference
+from ingestCheckpoint import IngestCheckpoint
+from keywordIndex import KeywordIndex
+from modelStore import load_blip, load_clip, load_text_model, load_yolo
+from parseSupervisor import ParseSupervisor, PARSE_TIMEOUT_SECONDS
+from pathIndex import PathPrefixIndex
+from searchDeadline import SearchDeadline
+from segmentStore import SegmentStore, index_vectors
+from textChunker import iter_passages
+from textEncoder import TextEncoder
+from textReader import read_text
+from textSegmentStore import TextSegmentStore
+from vectorProjection import VectorProjection, ensure_projection, search_vectors
 
 
 # Config constants
@@ -21,6 +34,17 @@ YOLO_SCORE_THRESH = 0.3
 MAX_IMAGE_REGIONS = 20
 BATCH_SIZE = 8
 CACHE_DIR = ".cache_fileai"
+# The image store embed_files writes and image search reads, with its projection.
+IMAGE_CACHE_DIR = os.path.join(CACHE_DIR, 'image_index_cache')
+TEXT_EMBED_BATCH = 256
+PASSAGE_OVERFETCH = 5
+# Target dimension of the learned PCA/OPQ projection for each index; 0 keeps full vectors.
+IMAGE_PROJECTION_DIM = 0
+TEXT_PROJECTION_DIM = 0
+# Share of a search's latency budget that walking and re-parsing text may use.
+TEXT_UPDATE_BUDGET_SHARE = 0.5
+# Forked processes sharing the loaded vision models during image ingestion; 1 embeds in-process.
+IMAGE_EMBED_WORKERS = 1
 
 
 # Ensure cache directory exists
@@ -31,31 +55,36 @@ os.makedirs(CACHE_DIR, exist_ok=True)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
-# Load models
+# Load models (from the local model store when prefetched; see modelStore.py)
 def load_models():
     print("[INFO] Loading YOLOv5 model...", file=sys.stderr)
     yolo = None
     try:
-        yolo = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True).to(device)
-        yolo.eval()
+        yolo = load_yolo(device)
         print("[INFO] YOLOv5 loaded.", file=sys.stderr)
     except Exception as e:
         print(f"[WARNING] YOLOv5 loading failed: {e}", file=sys.stderr)
-    print("[INFO] Loading CLIP models...", file=sys.stderr)
-    clip_proc = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-    clip_mod = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
-    clip_mod.eval()
+    clip_proc, clip_mod = load_clip_models()
     print("[INFO] Loading BLIP models...", file=sys.stderr)
-    blip_proc = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-    blip_mod = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base").to(device)
-    blip_mod.eval()
+    blip_proc, blip_mod = load_blip(device)
     print("[INFO] All models loaded.", file=sys.stderr)
     return yolo, clip_proc, clip_mod, blip_proc, blip_mod
 
 
+def load_clip_models():
+    # Searching only embeds the query, so it needs CLIP but not YOLO or BLIP.
+    print("[INFO] Loading CLIP models...", file=sys.stderr)
+    return load_clip(device)
+
+
 
 def parse_rtf_unrtf(file_path):
-    result = subprocess.run(['unrtf', '--text', file_path], capture_output=True, text=True)
+    try:
+        result = subprocess.run(['unrtf', '--text', file_path], capture_output=True, text=True,
+                                timeout=PARSE_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        print(f"[WARNING] UnRTF timed out on {file_path}", file=sys.stderr)
+        return ""
     if result.returncode == 0:
         return result.stdout.strip()
     else:
@@ -69,11 +98,11 @@ def clean_text(text: str) -> str:
 
 
 def parse_txt(filepath: str) -> str:
+    # Encoding is sniffed once and the file decoded in chunks, up to TEXT_BYTE_BUDGET bytes.
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
-    except UnicodeDecodeError:
-        print(f"[WARNING] Skipping non-UTF8 or binary file: {filepath}", file=sys.stderr)
+        return read_text(filepath)
+    except UnicodeError:
+        print(f"[WARNING] Skipping binary file or unsupported encoding: {filepath}", file=sys.stderr)
         return ""
 
 
@@ -118,38 +147,27 @@ def parse_file(filepath: str) -> str:
 
 
 def get_all_files_and_parse_optimized(directory: str,
-                                      text_exts=('.txt', '.pdf', '.docx', '.rtf'),
-                                      image_exts=('.jpg', '.jpeg', '.png', '.bmp', '.gif')) -> Tuple[List[str], List[str], List[str]]:
+                                      text_exts=TEXT_EXTENSIONS,
+                                      image_exts=IMAGE_EXTENSIONS) -> Tuple[List[str], List[str], List[str]]:
     text_texts = []
     text_paths = []
     image_paths = []
 
 
-    def parse_single_file(path):
-        try:
-            if path.lower().endswith(text_exts):
-                return 'text', parse_file(path), path
-            elif path.lower().endswith(image_exts):
-                return 'image', None, path
-        except Exception as e:
-            print(f"[WARNING] Error parsing {path}: {e}", file=sys.stderr)
-        return None, None, None
-
-
     print(f"[INFO] Walking directory {directory} and parsing files...", file=sys.stderr)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        futures = [executor.submit(parse_single_file, os.path.join(root, file))
-                   for root, _, files in os.walk(directory) for file in files]
-
-
-        for future in concurrent.futures.as_completed(futures):
-            typ, content, path = future.result()
-            if typ == 'text' and content:
-                text_texts.append(content)
-                text_paths.append(path)
-            elif typ == 'image' and path:
-                image_paths.append(path)
+    text_candidates = []
+    extension_kinds = {**{ext: 'text' for ext in text_exts}, **{ext: 'image' for ext in image_exts}}
+    for entry in scan_files(directory, extension_kinds=extension_kinds):
+        if entry.kind == 'text':
+            text_candidates.append(entry.path)
+        else:
+            image_paths.append(entry.path)
 
+    supervisor = ParseSupervisor(parse_file, os.path.join(CACHE_DIR, 'parse_quarantine.json'))
+    for path, content, ok in supervisor.imap(text_candidates):
+        if content:
+            text_texts.append(content)
+            text_paths.append(path)
 
     return text_texts, text_paths, image_paths
 
@@ -158,48 +176,238 @@ def get_all_files_and_parse_optimized(directory: str,
 # Embedding + Indexing and persistent cache save/load
 
 
-def save_embeddings_captions(embeddings_np, captions, image_to_region, image_paths, save_dir):
-    os.makedirs(save_dir, exist_ok=True)
-    np.save(os.path.join(save_dir, 'image_embeddings.npy'), embeddings_np)
-    dim = embeddings_np.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings_np)
-    faiss.write_index(index, os.path.join(save_dir, 'faiss_index.bin'))
-    meta = {
-        "captions": captions,
-        "image_to_region": image_to_region,
-        "image_paths": image_paths
-    }
-    with open(os.path.join(save_dir, 'index_metadata.json'), 'w') as f:
-        json.dump(meta, f)
+def save_embeddings_captions(embeddings_np, captions, image_to_region, image_paths, save_dir, image_stats=None):
+    # Appends the batch as a new segment; nothing already in the cache is rewritten.
+    SegmentStore(save_dir).append(embeddings_np, captions, image_to_region, image_paths, image_stats)
 
 
-def load_embeddings_captions(save_dir):
+def load_embeddings_captions(save_dir, projection=None):
     try:
-        embeddings_np = np.load(os.path.join(save_dir, 'image_embeddings.npy'))
-        index = faiss.read_index(os.path.join(save_dir, 'faiss_index.bin'))
-        with open(os.path.join(save_dir, 'index_metadata.json'), 'r') as f:
-            meta = json.load(f)
-        captions = meta['captions']
-        image_to_region = [tuple(pair) for pair in meta['image_to_region']]
-        image_paths = meta['image_paths']
-        return embeddings_np, index, captions, image_to_region, image_paths
+        embeddings_np, index, captions, image_to_region, image_paths, pooled_np = SegmentStore(save_dir).load(projection)
+        if embeddings_np is None:
+            raise FileNotFoundError(f"no image index in {save_dir}")
+        return embeddings_np, index, captions, image_to_region, image_paths, pooled_np
     except Exception as e:
         print(f"[WARN] Failed to load cached embeddings and metadata: {e}", file=sys.stderr)
-        return None, None, None, None, None
+        return None, None, None, None, None, None
 
 
+def update_image_projection(save_dir):
+    # Trains (or keeps) the projection for the whole store; it is applied when the store is loaded.
+    if IMAGE_PROJECTION_DIM <= 0:
+        return None
+    embeddings_np = SegmentStore(save_dir).load()[0]
+    return ensure_projection(os.path.join(save_dir, 'projection'), embeddings_np, IMAGE_PROJECTION_DIM)
 
-def embed_and_index_texts(texts: List[str]):
-    print("[INFO] Embedding texts with SentenceTransformer...", file=sys.stderr)
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    embeddings = model.encode(texts, convert_to_tensor=False)
-    embeddings_np = np.array(embeddings).astype('float32')
-    dim = embeddings_np.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings_np)
-    print("[INFO] Text embeddings indexed.", file=sys.stderr)
-    return index, model, embeddings_np.shape[0]
+
+def _region_map_signature(image_paths, image_to_region) -> str:
+    # A re-embedded image moves its rows to the end of the store, which can keep the
+    # row count unchanged, so the signature covers the image order and row owners.
+    owners = np.fromiter((img_idx for img_idx, _ in image_to_region), dtype=np.int64, count=len(image_to_region))
+    paths_crc = zlib.crc32('\n'.join(image_paths).encode('utf-8', 'surrogateescape'))
+    return f"{len(image_to_region)}:{paths_crc}:{zlib.crc32(owners.tobytes())}"
+
+
+def load_path_index(save_dir, image_paths, image_to_region):
+    signature = _region_map_signature(image_paths, image_to_region)
+    try:
+        path_index = PathPrefixIndex.load(os.path.join(save_dir, 'path_index.json'))
+        if path_index.signature == signature:
+            return path_index
+    except Exception:
+        pass
+    # Caches written before the path index existed (or changed since): rebuild once and keep it.
+    path_index = PathPrefixIndex.from_region_map(image_paths, image_to_region)
+    path_index.signature = signature
+    try:
+        path_index.save(os.path.join(save_dir, 'path_index.json'))
+    except OSError as e:
+        print(f"[WARN] Could not persist path index: {e}", file=sys.stderr)
+    return path_index
+
+
+def _read_text_store(store: TextSegmentStore):
+    # load_text_index plus the manifest generation the state was read at.
+    try:
+        projection = VectorProjection.load(os.path.join(store.store_dir, 'projection'), TEXT_PROJECTION_DIM)
+        loaded = store.load(projection)
+        if loaded is None:
+            raise FileNotFoundError(f"no {store.manifest_path}")
+        if projection is None and TEXT_PROJECTION_DIM > 0:
+            projection = ensure_projection(os.path.join(store.store_dir, 'projection'), loaded[0],
+                                           TEXT_PROJECTION_DIM)
+            if projection is not None:
+                # Read again as a projected index over the memory-mapped full vectors;
+                # maintain() then stores the projected vectors with the segments.
+                loaded = store.load(projection)
+                store.maintain_in_background(projection)
+        (embeddings_np, index, keyword_index, file_paths, file_stats,
+         passage_files, passage_offsets, generation) = loaded
+        live_files = [i for i, stat in enumerate(file_stats) if stat is not None]
+        path_index = PathPrefixIndex.from_row_owners(file_paths, passage_files, live_files)
+        return (embeddings_np, index, keyword_index, file_paths, file_stats,
+                passage_files, passage_offsets, path_index, projection), generation
+    except Exception as e:
+        print(f"[INFO] No usable text index cache in {store.store_dir}: {e}", file=sys.stderr)
+        return (None, None, KeywordIndex(), [], [],
+                np.array([], dtype=np.int64), np.empty((0, 2), dtype=np.int64), PathPrefixIndex([]), None), 0
+
+
+def load_text_index(save_dir):
+    """
+    (embeddings_np, index, keyword_index, file_paths, file_stats, passage_files,
+    passage_offsets, path_index, projection) for the cached passage index.
+    `file_stats[i]` is None for files that were deleted or re-parsed since.
+    """
+    return _read_text_store(TextSegmentStore(save_dir))[0]
+
+
+def update_text_index(search_path: Optional[str], text_entries, model, save_dir, deadline: SearchDeadline = None):
+    """
+    Bring the cached passage index up to date for the ScanEntry list `text_entries`
+    found under `search_path`:
+    files whose (mtime, size) changed are re-parsed, chunked and re-embedded, files
+    that disappeared from the subtree are dropped, and everything else is reused.
+    With `search_path` None only the given files are added or refreshed.
+
+    Each row of the index is one passage; `passage_files[row]` is its file and
+    `passage_offsets[row]` its character span. Passages are handed to the
+    TextEncoder TEXT_EMBED_BATCH at a time, and each finished window is appended
+    to the new segment's .npy and added to the index, so memory holds the index
+    plus one document and the windows in flight.
+
+    The loaded index is patched in place (rows of dropped files removed, new rows
+    added) and only the new passages are written, as one TextSegmentStore
+    segment, so the cost follows the number of changed files rather than the
+    corpus. If another process committed in between, the merged state is
+    re-read from the store instead.
+
+    With TEXT_PROJECTION_DIM set, the returned index holds projected vectors
+    and `projection` must be passed on to the search.
+
+    A changed file's old passages are only replaced once it has been re-parsed.
+    With a `deadline`, parsing stops once TEXT_UPDATE_BUDGET_SHARE of the budget
+    is spent; files not reached by then keep their old passages and stat, so
+    they are searched as cached and re-parsed by a later update.
+    """
+    store = TextSegmentStore(save_dir)
+    (embeddings_np, index, keyword_index, file_paths, file_stats,
+     passage_files, passage_offsets, path_index, projection), generation = _read_text_store(store)
+    file_of = {p: i for i, (p, stat) in enumerate(zip(file_paths, file_stats)) if stat is not None}
+    # The scanner already yields normalized paths with their stat results.
+    current = {entry.path: (entry.mtime_ns, entry.size) for entry in text_entries}
+
+    stale = [p for p in path_index.paths_under(search_path) if p not in current] if search_path is not None else []
+    changed = [p for p, stat in current.items() if p not in file_of or file_stats[file_of[p]] != stat]
+    if not changed and not stale:
+        return embeddings_np, index, keyword_index, file_paths, passage_files, passage_offsets, path_index, projection
+
+    dim = model.get_sentence_embedding_dimension()
+    if index is None:
+        index = faiss.IndexFlatL2(dim if projection is None else projection.dim_out)
+    loaded_rows = index.ntotal
+    dead_paths = list(stale)
+    new_paths, new_stats, new_rows = [], [], []
+    file_parts, offset_parts = [], []
+    new_keywords = KeywordIndex()
+    batch, batch_files, batch_offsets = [], [], []
+    new_segment = store.open_segment(dim)
+
+    def add_encoded(windows):
+        # Windows come back in submission order, so passage rows stay grouped by file.
+        # New rows go after the loaded ones; rows of dead files are removed once committed.
+        for (files, offsets), texts, emb in windows:
+            new_segment.append(emb)
+            index.add(projection.apply(emb) if projection is not None else np.ascontiguousarray(emb, dtype='float32'))
+            new_keywords.add_documents(texts)
+            file_parts.append(files)
+            offset_parts.append(offsets)
+
+    def flush():
+        if not batch:
+            return
+        payload = (np.array(batch_files, dtype=np.int64), np.array(batch_offsets, dtype=np.int64))
+        add_encoded(encoder.submit(list(batch), payload))
+        del batch[:], batch_files[:], batch_offsets[:]
+
+    print(f"[INFO] Chunking and embedding {len(changed)} new or changed text files...", file=sys.stderr)
+    supervisor = ParseSupervisor(parse_file, os.path.join(CACHE_DIR, 'parse_quarantine.json'))
+    parse_deadline = deadline.until(TEXT_UPDATE_BUDGET_SHARE) if deadline is not None else None
+    parsed = 0
+    try:
+        with TextEncoder(model) as encoder:
+            for p, text_content, ok in supervisor.imap(changed, deadline=parse_deadline):
+                parsed += 1
+                if p in file_of:
+                    dead_paths.append(p)
+                if not ok:
+                    # Timed out or crashed: leave it out so it is retried until the supervisor quarantines it.
+                    continue
+                # Files without text are still recorded so they are not re-parsed until they change.
+                new_paths.append(p)
+                new_stats.append(current[p])
+                new_rows.append(0)
+                for start, end, passage in iter_passages(text_content):
+                    batch.append(passage)
+                    batch_files.append(len(new_paths) - 1)
+                    batch_offsets.append((start, end))
+                    new_rows[-1] += 1
+                    if len(batch) >= TEXT_EMBED_BATCH:
+                        flush()
+            flush()
+            add_encoded(encoder.drain())
+    except BaseException:
+        new_segment.abort()
+        raise
+    if deadline is not None and parsed < len(changed):
+        deadline.skip(f"text re-parse ({len(changed) - parsed} of {len(changed)} changed files)")
+
+    new_files = np.concatenate(file_parts) if file_parts else np.array([], dtype=np.int64)
+    new_offsets = np.concatenate(offset_parts).reshape(-1, 2) if offset_parts else np.empty((0, 2), dtype=np.int64)
+    segment = None
+    if new_segment.rows:
+        # The projected rows are stored from the index itself rather than a second copy.
+        new_projected = index_vectors(index)[loaded_rows:] if projection is not None else None
+        segment = store.write_segment(new_segment, new_files, new_offsets, new_keywords, new_projected,
+                                      projection.trained_rows if projection is not None else None)
+    else:
+        new_segment.abort()
+    if store.commit(segment, new_paths, new_stats, new_rows, dead_paths, dim) != generation:
+        # Someone else committed since we loaded: their rows are only in the store.
+        (embeddings_np, index, keyword_index, file_paths, file_stats,
+         passage_files, passage_offsets, path_index, projection), _ = _read_text_store(store)
+    else:
+        dead_files = sorted({file_of[p] for p in dead_paths if p in file_of})
+        dead_rows = np.flatnonzero(np.isin(passage_files, dead_files))
+        if dead_rows.size:
+            # IndexFlat.remove_ids keeps the remaining rows (the new ones last) in order.
+            index.remove_ids(faiss.IDSelectorBatch(dead_rows))
+            keyword_index.keep_documents(np.delete(np.arange(passage_files.size), dead_rows))
+        keyword_index.extend(new_keywords)
+        base = len(file_paths)
+        passage_files = np.concatenate([np.delete(passage_files, dead_rows), new_files + base])
+        passage_offsets = np.concatenate([np.delete(passage_offsets, dead_rows, axis=0), new_offsets])
+        file_stats = list(file_stats)
+        for i in dead_files:
+            file_stats[i] = None
+        file_paths = file_paths + new_paths
+        file_stats += new_stats
+        if projection is None:
+            embeddings_np = index_vectors(index)
+        else:
+            embeddings_np = embeddings_np.delete(dead_rows)
+            if segment is not None:
+                # The new full vectors are read back from the segment just written, memory-mapped.
+                embeddings_np = embeddings_np.append(np.load(new_segment.file_path, mmap_mode='r'))
+        updated = ensure_projection(os.path.join(save_dir, 'projection'), embeddings_np, TEXT_PROJECTION_DIM)
+        if updated is not None and (projection is None or updated.trained_rows != projection.trained_rows):
+            # First projection, or retrained after the index grew; the store catches up in maintain().
+            index = updated.build_index(embeddings_np)
+            projection = updated
+        live_files = [i for i, stat in enumerate(file_stats) if stat is not None]
+        path_index = PathPrefixIndex.from_row_owners(file_paths, passage_files, live_files)
+    store.maintain_in_background(projection)
+    return embeddings_np, index, keyword_index, file_paths, passage_files, passage_offsets, path_index, projection
 
 
 def embed_text_clip(text: str, clip_processor, clip_model) -> np.ndarray:
@@ -258,15 +466,40 @@ def detect_and_embed_objects_optimized(image_path: str, yolo_model, clip_process
     return crops, embeddings_np, captions
 
 
-def embed_images_with_object_detection(image_paths: List[str], yolo_model, clip_processor, clip_model, blip_processor, blip_model) -> Tuple[np.ndarray, List[Tuple[int, int]], List[str]]:
+def iter_image_embeddings(image_paths: List[str], yolo_model, clip_processor, clip_model, blip_processor, blip_model,
+                          start: int = 0, workers: int = IMAGE_EMBED_WORKERS):
+    """
+    Yield (img_idx, embeddings, captions) for image_paths[start:] in order, with
+    None embeddings for images that failed. With workers > 1 the images are
+    sharded over forked processes that share the models (see ForkedImageWorkers).
+    """
+    def embed(img_path):
+        crops, emb, caps = detect_and_embed_objects_optimized(img_path, yolo_model, clip_processor, clip_model, blip_processor, blip_model)
+        return emb, caps
+
+    if str(device).startswith('cuda'):
+        # CUDA contexts do not survive fork; the GPU is shared by batching instead.
+        workers = 1
+    for img_idx, result, error in ForkedImageWorkers(embed, workers).imap(image_paths, start):
+        if error is not None:
+            print(f"[WARNING] Detection/embedding error for {image_paths[img_idx]}: {error}", file=sys.stderr)
+            yield img_idx, None, []
+        else:
+            yield img_idx, result[0], result[1]
+
+
+def embed_images_with_object_detection(image_paths: List[str], yolo_model, clip_processor, clip_model, blip_processor, blip_model,
+                                       checkpoint_dir: str = None,
+                                       workers: int = IMAGE_EMBED_WORKERS) -> Tuple[np.ndarray, List[Tuple[int, int]], List[str]]:
+    if checkpoint_dir is not None:
+        return ingest_images_checkpointed(image_paths, yolo_model, clip_processor, clip_model, blip_processor, blip_model,
+                                          checkpoint_dir, workers)
     all_embeddings = []
     image_to_region = []
     all_captions = []
-    for img_idx, img_path in enumerate(image_paths):
-        try:
-            crops, emb, caps = detect_and_embed_objects_optimized(img_path, yolo_model, clip_processor, clip_model, blip_processor, blip_model)
-        except Exception as e:
-            print(f"[WARNING] Detection/embedding error for {img_path}: {e}", file=sys.stderr)
+    for img_idx, emb, caps in iter_image_embeddings(image_paths, yolo_model, clip_processor, clip_model, blip_processor,
+                                                    blip_model, workers=workers):
+        if emb is None:
             continue
         all_embeddings.extend(emb)
         image_to_region.extend([(img_idx, i) for i in range(emb.shape[0])])
@@ -277,6 +510,27 @@ def embed_images_with_object_detection(image_paths: List[str], yolo_model, clip_
     return embeddings_np, image_to_region, all_captions
 
 
+def ingest_images_checkpointed(image_paths: List[str], yolo_model, clip_processor, clip_model, blip_processor, blip_model,
+                               checkpoint_dir: str, workers: int = IMAGE_EMBED_WORKERS) -> Tuple[np.ndarray, List[Tuple[int, int]], List[str]]:
+    """
+    Resumable variant of embed_images_with_object_detection. Results are written
+    to `checkpoint_dir` in periodic chunks and only the current chunk is held in
+    memory; an interrupted run called again with the same `image_paths` picks up
+    after the last flushed image. The returned embeddings are memory-mapped.
+    """
+    checkpoint = IngestCheckpoint(checkpoint_dir, image_paths)
+    try:
+        for img_idx, emb, caps in iter_image_embeddings(image_paths, yolo_model, clip_processor, clip_model,
+                                                        blip_processor, blip_model, checkpoint.next_image, workers):
+            checkpoint.add(img_idx, emb, caps)
+    finally:
+        # Also runs on Ctrl-C, so every image finished before the interrupt is kept.
+        checkpoint.flush()
+    if not checkpoint.chunks:
+        return np.array([]), [], []
+    return checkpoint.assemble()
+
+
 def build_image_index(embeddings_np: np.ndarray):
     dim = embeddings_np.shape[1]
     index = faiss.IndexFlatL2(dim)
@@ -284,14 +538,17 @@ def build_image_index(embeddings_np: np.ndarray):
     return index
 
 
-from sentence_transformers import SentenceTransformer as ST
-
-
-_word_embedding_model = ST('all-MiniLM-L6-v2')
+@functools.lru_cache(maxsize=None)
+def get_text_model():
+    # Loaded on first use, not at import: spawned encoder workers re-import this
+    # module as __mp_main__ and must not each load a second copy of MiniLM.
+    # Every caller runs it in this process, which rules out forking image workers later.
+    note_inference()
+    return load_text_model()
 
 
 def _get_word_embeddings(words: List[str]):
-    return _word_embedding_model.encode(words, convert_to_tensor=False)
+    return get_text_model().encode(words, convert_to_tensor=False)
 
 
 def semantic_soft_keyword_boost(query: str, caption: str, threshold: float = 0.7, boost_factor: float = 0.15):
@@ -307,19 +564,34 @@ def semantic_soft_keyword_boost(query: str, caption: str, threshold: float = 0.7
         max_sim = np.max(sims) if sims.size > 0 else 0.0
         if max_sim >= threshold:
             boost_score += boost_factor * max_sim
-    return boost_score
+    return float(boost_score)
 
 
-def semantic_search_images(index, image_paths, image_to_region, captions, query: str, clip_processor, clip_model, k: int = 5):
+def semantic_search_images(index, image_paths, image_to_region, captions, query: str, clip_processor, clip_model, k: int = 5,
+                           ids=None, embeddings_np=None, projection=None, region_index=None,
+                           deadline: SearchDeadline = None):
+    """
+    With an ImageRegionIndex, candidates are the best regions of distinct
+    images; otherwise k * 5 regions are fetched and deduplicated per file.
+    Once `deadline` has expired the caption boost is no longer computed.
+    """
     query_emb = embed_text_clip(query, clip_processor, clip_model)
-    distances, indices = index.search(np.expand_dims(query_emb, axis=0), k * 5)
+    if region_index is not None:
+        hits = region_index.search(query_emb, k, ids)
+    else:
+        distances, indices = search_vectors(index, embeddings_np, query_emb, k * 5, ids, projection)
+        hits = zip(distances[0], indices[0])
     best_scores_per_image = {}
-    for dist, idx in zip(distances[0], indices[0]):
+    for dist, idx in hits:
         img_idx, region_idx = image_to_region[idx]
         file_path = image_paths[img_idx]
         score = 1 / (1 + dist)
         caption = captions[idx] if idx < len(captions) else ""
-        keyword_boost = semantic_soft_keyword_boost(query, caption)
+        if deadline is not None and deadline.expired():
+            deadline.skip("caption boost")
+            keyword_boost = 0.0
+        else:
+            keyword_boost = semantic_soft_keyword_boost(query, caption)
         final_score = score + keyword_boost
         if file_path not in best_scores_per_image or final_score > best_scores_per_image[file_path]['final_score']:
             best_scores_per_image[file_path] = {
@@ -334,37 +606,71 @@ def semantic_search_images(index, image_paths, image_to_region, captions, query:
     return results
 
 
-def keyword_score(text: str, query: str) -> float:
-    query_words = set(query.lower().split())
-    text_words = set(text.lower().split())
-    common = query_words.intersection(text_words)
-    return len(common) / len(query_words) if query_words else 0
-
-
-def hybrid_semantic_search(index, model, texts, file_paths, query: str, k: int = 5, alpha: float = 0.5):
-    k = min(k, len(texts))
+def hybrid_semantic_search(index, model, keyword_index, file_paths, query: str, k: int = 5, alpha: float = 0.5,
+                           ids=None, embeddings_np=None, passage_files=None, passage_offsets=None, projection=None):
+    """
+    Union of the semantic top-k (FAISS) and the lexical top-k (BM25 over the
+    inverted index). Candidates found by only one side are scored on the other
+    from stored vectors and postings, so no document text is read at query time.
+
+    With `passage_files`, index rows are passages: both sides over-fetch
+    PASSAGE_OVERFETCH passages per result and each file keeps its best passage.
+    With a `projection`, `index` holds projected vectors and `embeddings_np` the
+    full ones used to re-score its candidates.
+    """
+    fetch = k * PASSAGE_OVERFETCH if passage_files is not None else k
+    fetch = min(fetch, index.ntotal if ids is None else len(ids))
     query_embedding = model.encode([query], convert_to_tensor=False)
     query_embedding_np = np.array(query_embedding).astype("float32")
-    distances, indices = index.search(query_embedding_np, k)
-    results = []
-    max_distance = max(distances[0]) if distances[0].size > 0 else 1e-6
-    for dist, idx in zip(distances[0], indices[0]):
+    distances, indices = search_vectors(index, embeddings_np, query_embedding_np, fetch, ids, projection)
+    bm25_ids, bm25_scores = keyword_index.score(query, ids)
+    bm25_of = dict(zip(bm25_ids.tolist(), bm25_scores.tolist()))
+    lexical_top = bm25_ids[np.argsort(-bm25_scores)[:fetch]]
+
+    dist_of = dict(zip(indices[0].tolist(), distances[0].tolist()))
+    missing = np.array([idx for idx in lexical_top.tolist() if idx not in dist_of], dtype=np.int64)
+    if missing.size > 0:
+        vectors = embeddings_np[missing] if embeddings_np is not None else index.reconstruct_batch(missing)
+        missing_dists = ((np.asarray(vectors, dtype=np.float32) - query_embedding_np) ** 2).sum(axis=1)
+        dist_of.update(zip(missing.tolist(), missing_dists.tolist()))
+
+    best_per_file = {}
+    max_distance = max(dist_of.values()) if dist_of else 1e-6
+    max_bm25 = max(bm25_of.values()) if bm25_of else 0.0
+    for idx, dist in dist_of.items():
         sem_score = 1 - dist / (max_distance + 1e-12)
-        kw_score = keyword_score(texts[idx], query)
+        kw_score = bm25_of.get(idx, 0.0) / max_bm25 if max_bm25 > 0 else 0.0
         combined_score = alpha * sem_score + (1 - alpha) * kw_score
-        results.append(
-            {
-                "file_path": file_paths[idx],
-                "semantic_score": sem_score,
-                "keyword_score": kw_score,
-                "combined_score": combined_score,
-            }
-        )
-    results = sorted(results, key=lambda x: x["combined_score"], reverse=True)
+        file_idx = int(passage_files[idx]) if passage_files is not None else idx
+        if file_idx in best_per_file and best_per_file[file_idx]["combined_score"] >= combined_score:
+            continue
+        result = {
+            "file_path": file_paths[file_idx],
+            "semantic_score": sem_score,
+            "keyword_score": kw_score,
+            "combined_score": combined_score,
+        }
+        if passage_offsets is not None:
+            result["passage_offsets"] = [int(o) for o in passage_offsets[idx]]
+        best_per_file[file_idx] = result
+    results = sorted(best_per_file.values(), key=lambda x: x["combined_score"], reverse=True)
     return results[:k]
 
 
-def run_method(method, path, target=None, type=None):
+def scan_text_entries(search_path: str, deadline: SearchDeadline):
+    """Text files under `search_path`, or None if the walk outran its share of the budget."""
+    cutoff = deadline.until(TEXT_UPDATE_BUDGET_SHARE)
+    entries = []
+    for entry in scan_files(search_path, kinds={'text'}):
+        entries.append(entry)
+        # A partial listing would make unvisited files look deleted, so it is dropped entirely.
+        if cutoff is not None and len(entries) % 256 == 0 and time.monotonic() >= cutoff:
+            deadline.skip("text walk and re-parse")
+            return None
+    return entries
+
+
+def run_method(method, path, target=None, type=None, budget_seconds=None, on_event=None):
     """
     Command line entry point to run embedding or search.
 
@@ -374,6 +680,14 @@ def run_method(method, path, target=None, type=None):
              for 'search': path (file or directory) to search in
     args[2]: for 'search': user query string to search for
     args[3]: type string, either "text" or "image" indicating scope to include files of this category only
+    args[4]: for 'search': optional latency budget in seconds. Results from the
+             cached indexes come first; walking/re-parsing text, image search and
+             the caption boost are cut short once the budget runs out, and the
+             response then carries "partial": true and the "skipped" stages.
+
+    For 'search', `on_event(dict)` is called with a "progress" event as each
+    stage starts and with the "text_results" and "image_results" batches as soon
+    as each is ready; the full result is still returned at the end.
     """
     method = method
 
@@ -409,48 +723,63 @@ def run_method(method, path, target=None, type=None):
         search_path = path
         query = target
         requested_type = type.lower() if type else 'all'
+        deadline = SearchDeadline(budget_seconds)
+        emit = on_event or (lambda event: None)
 
-        if os.path.isdir(search_path):
-            all_file_paths = []
-            for root, _, files in os.walk(search_path):
-                for file in files:
-                    all_file_paths.append(os.path.join(root, file))
-        elif os.path.isfile(search_path):
-            all_file_paths = [search_path]
-        else:
+        if not os.path.isdir(search_path) and not os.path.isfile(search_path):
             return {"error": f"Search path '{search_path}' is not a valid file or directory"}
 
-        if requested_type == 'text':
-            filtered_paths = [p for p in all_file_paths if p.lower().endswith(text_exts)]
-        elif requested_type == 'image':
-            filtered_paths = [p for p in all_file_paths if p.lower().endswith(image_exts)]
-        else:
-            filtered_paths = all_file_paths
-
-        all_texts = []
-        text_file_paths = []
+        text_results = []
         if requested_type in ['text', 'all']:
-            for path in filtered_paths:
-                if path.lower().endswith(text_exts):
-                    text_content = parse_file(path)
-                    if text_content:
-                        all_texts.append(text_content)
-                        text_file_paths.append(path)
+            # Only files under search_path are (re)parsed, and only if they changed since
+            # they were cached; the search itself is restricted to that subtree's rows.
+            # Image search needs no walk at all: the path index resolves the subtree.
+            emit({"type": "progress", "stage": "text", "message": f"Updating text index for {search_path}"})
+            text_model = get_text_model()
+            text_cache_path = os.path.join(CACHE_DIR, 'text_index_cache')
+            text_entries = scan_text_entries(search_path, deadline)
+            if text_entries is not None:
+                (text_embeddings_np, text_index, keyword_index, text_file_paths,
+                 passage_files, passage_offsets, text_path_index, text_projection) = update_text_index(
+                    search_path, text_entries, text_model, text_cache_path, deadline)
+            else:
+                # Out of time before the walk finished: search the cached index as it is.
+                (text_embeddings_np, text_index, keyword_index, text_file_paths, _,
+                 passage_files, passage_offsets, text_path_index, text_projection) = load_text_index(text_cache_path)
+            text_ids = text_path_index.ids_under(search_path)
 
-        if len(all_texts) == 0 and requested_type in ['text', 'all']:
-            return {"error": "No text files found for searching"}
+            if text_ids.size == 0:
+                return {"error": "No text files found for searching"}
 
-        if requested_type in ['text', 'all']:
-            text_index, text_model, _ = embed_and_index_texts(all_texts)
+            text_results = hybrid_semantic_search(
+                text_index,
+                text_model,
+                keyword_index,
+                text_file_paths,
+                query,
+                k=10,
+                alpha=0.7,
+                ids=text_ids,
+                embeddings_np=text_embeddings_np,
+                passage_files=passage_files,
+                passage_offsets=passage_offsets,
+                projection=text_projection
+            )
+            emit({"type": "text_results", "results": text_results})
 
         image_results = []
-        if requested_type in ['image', 'all']:
-            cache_path = os.path.join(CACHE_DIR, 'image_index_cache')
-            embeddings_np_cached, image_index_cached, captions_cached, image_to_region_cached, image_paths_cached = load_embeddings_captions(cache_path)
+        if requested_type in ['image', 'all'] and deadline.expired():
+            deadline.skip("image search")
+        elif requested_type in ['image', 'all']:
+            emit({"type": "progress", "stage": "image", "message": "Searching image index"})
+            cache_path = IMAGE_CACHE_DIR
+            image_projection = VectorProjection.load(os.path.join(cache_path, 'projection'), IMAGE_PROJECTION_DIM)
+            (embeddings_np_cached, image_index_cached, captions_cached, image_to_region_cached, image_paths_cached,
+             pooled_np) = load_embeddings_captions(cache_path, image_projection)
 
             if embeddings_np_cached is not None:
-                cache_set = set(image_paths_cached or [])
-                filtered_image_paths = [p for p in filtered_paths if p in cache_set]
+                path_index = load_path_index(cache_path, image_paths_cached, image_to_region_cached)
+                image_ids = path_index.ids_under(search_path)
 
                 embeddings_np = embeddings_np_cached
                 image_index = image_index_cached
@@ -458,37 +787,40 @@ def run_method(method, path, target=None, type=None):
                 image_to_region = image_to_region_cached
                 image_paths_all = image_paths_cached
 
-                yolo, clip_processor, clip_model, blip_processor, blip_model = load_models()
-
-                image_results = semantic_search_images(
-                    image_index,
-                    image_paths_all,
-                    image_to_region,
-                    captions,
-                    query,
-                    clip_processor,
-                    clip_model,
-                    k=10
-                )
+                if image_ids.size > 0:
+                    note_inference()
+                    clip_processor, clip_model = load_clip_models()
+                    region_index = ImageRegionIndex(embeddings_np, image_to_region, len(image_paths_all),
+                                                    image_projection, pooled_np)
+
+                    image_results = semantic_search_images(
+                        image_index,
+                        image_paths_all,
+                        image_to_region,
+                        captions,
+                        query,
+                        clip_processor,
+                        clip_model,
+                        k=10,
+                        ids=image_ids,
+                        embeddings_np=embeddings_np,
+                        projection=image_projection,
+                        region_index=region_index,
+                        deadline=deadline
+                    )
             else:
                 image_results = []
+        if requested_type in ['image', 'all']:
+            emit({"type": "image_results", "results": image_results})
 
-        text_results = []
-        if requested_type in ['text', 'all'] and len(all_texts) > 0:
-            text_results = hybrid_semantic_search(
-                text_index,
-                text_model,
-                all_texts,
-                text_file_paths,
-                query,
-                k=10,
-                alpha=0.7
-            )
-
-        return {
+        result = {
             "text_results": text_results,
             "image_results": image_results
         }
+        if budget_seconds is not None:
+            result["partial"] = deadline.partial
+            result["skipped"] = deadline.skipped
+        return result
 
     else:
         return {"error": f"Unknown method {method}"}
@@ -498,32 +830,62 @@ def embed_files(file_paths: List[str]) -> Tuple[np.ndarray, np.ndarray, List[str
     image_exts = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
 
     text_paths = [p for p in file_paths if p.lower().endswith(text_exts)]
-    image_paths = [p for p in file_paths if p.lower().endswith(image_exts)]
-
-    all_texts = []
-    for path in text_paths:
-        text = parse_file(path)
-        if text:
-            all_texts.append(text)
-
-    text_index, text_model, text_count = embed_and_index_texts(all_texts)
-    yolo, clip_processor, clip_model, blip_processor, blip_model = load_models()
-    image_embeddings_np, image_to_region, all_captions = embed_images_with_object_detection(
-        image_paths, yolo, clip_processor, clip_model, blip_processor, blip_model)
-
-    cache_dir = os.path.join(CACHE_DIR, 'combined_embedding_cache')
-    save_embeddings_captions(image_embeddings_np, all_captions, image_to_region, image_paths, cache_dir)
+    cache_dir = IMAGE_CACHE_DIR
+    # An image is re-embedded unless the store has it at its current mtime and size.
+    indexed = SegmentStore(cache_dir).image_stats()
+    image_entries = [entry for p in file_paths if p.lower().endswith(image_exts)
+                     for entry in scan_files(p, kinds={'image'})
+                     if indexed.get(entry.path) != (entry.mtime_ns, entry.size)]
+    image_paths = [entry.path for entry in image_entries]
+
+    # Images first: their workers fork from this process, which must not have run
+    # any inference yet (see ForkedImageWorkers), and the text model runs here.
+    image_embeddings_np, image_to_region, all_captions = np.array([]), [], []
+    if image_paths:
+        yolo, clip_processor, clip_model, blip_processor, blip_model = load_models()
+        checkpoint_dir = os.path.join(CACHE_DIR, 'image_ingest_checkpoint')
+        image_embeddings_np, image_to_region, all_captions = embed_images_with_object_detection(
+            image_paths, yolo, clip_processor, clip_model, blip_processor, blip_model, checkpoint_dir=checkpoint_dir)
+
+        if image_to_region:
+            save_embeddings_captions(image_embeddings_np, all_captions, image_to_region, image_paths, cache_dir,
+                                     [(entry.mtime_ns, entry.size) for entry in image_entries])
+            update_image_projection(cache_dir)
+        IngestCheckpoint(checkpoint_dir, image_paths).clear()
+
+    # Text goes into the passage index the search reads, parsed and encoded file by file.
+    text_entries = [entry for p in text_paths for entry in scan_files(p, kinds={'text'})]
+    text_index = update_text_index(None, text_entries, get_text_model(),
+                                   os.path.join(CACHE_DIR, 'text_index_cache'))[1]
 
     return text_index, image_embeddings_np, all_captions, image_to_region, image_paths
 
 
 
 if __name__ == "__main__":
+    # semanticSearch.py [--stream] <path> <query> [budget_seconds]
+    # --stream writes NDJSON events (progress, text_results, image_results, then
+    # done or error) as they happen instead of one JSON document at the end.
+    args = sys.argv[1:]
+    stream = '--stream' in args
+    args = [a for a in args if a != '--stream']
     try:
-        file_path = sys.argv[1]
-        query = sys.argv[2]
-        result = run_method("search", file_path, query)
-        print(json.dumps(result))
+        file_path = args[0]
+        query = args[1]
+        budget_seconds = float(args[2]) if len(args) > 2 else None
+        if stream:
+            def emit(event):
+                print(json.dumps(event), flush=True)
+            result = run_method("search", file_path, query, budget_seconds=budget_seconds, on_event=emit)
+            if "error" in result:
+                emit({"type": "error", "error": result["error"]})
+            else:
+                emit({"type": "done", "partial": result.get("partial", False), "skipped": result.get("skipped", [])})
+        else:
+            result = run_method("search", file_path, query, budget_seconds=budget_seconds)
+            print(json.dumps(result))
     except Exception as e:
         print(f"[ERROR] {str(e)}", file=sys.stderr)
+        if stream:
+            print(json.dumps({"type": "error", "error": str(e)}), flush=True)
         sys.exit(1)
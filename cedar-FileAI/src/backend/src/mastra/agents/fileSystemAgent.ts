@@ -33,6 +33,7 @@ Your primary functions include:
 <tools_available>
 You have access to these file system tools:
 - read-file-content: Read the contents of any file
+- read-files-content: Read the contents of many files in one call (use this for several files or a whole folder)
 - list-directory: List all files and folders in a directory with details
 - move-file: Move or rename files from one location to another
 - search-files-semantic: Search for files by name or content
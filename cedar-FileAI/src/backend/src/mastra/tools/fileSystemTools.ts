@@ -5,7 +5,8 @@ import * as fsSync from 'fs';
 import * as path from 'path';
 import * as zlib from 'zlib';
 import { pipeline } from 'stream/promises';
-import { execFile } from 'child_process';
+import { execFile, spawn } from 'child_process';
+import * as readline from 'readline';
 import { promisify } from 'util';
 
 
@@ -36,6 +37,59 @@ export const readFileContent = createTool({
   },
 });
 
+export const readFilesContent = createTool({
+  id: 'read-files-content',
+  description: 'Reads and parses many files at once via the Python parser in a single batch; prefer this over read-file-content when reading several files or a whole folder',
+  inputSchema: z.object({
+    filePaths: z.array(z.string()).describe('The paths of the files to read'),
+  }),
+  outputSchema: z.object({
+    results: z.array(z.object({
+      path: z.string(),
+      type: z.string(),
+      content: z.string().nullable().optional(),
+      metadata: z.record(z.any()).optional(),
+      error: z.string().optional(),
+    })),
+  }),
+  execute: async ({ context }) => {
+    const pythonScriptPath = '/Users/rohannair/Desktop/Projects/HackGT/FileAI/cedar-FileAI/src/backend/fileParse.py'; // adjust path as needed
+    // Paths go over stdin and results come back as one JSON line per file, so the
+    // batch is not limited by argv length or a single stdout buffer.
+    const child = spawn('python3', [pythonScriptPath, '-'], { stdio: ['pipe', 'pipe', 'inherit'] });
+    const exited: Promise<number> = new Promise((resolve, reject) => {
+      child.on('error', reject);
+      child.on('close', (code) => resolve(code ?? -1));
+    });
+    child.stdin.end(context.filePaths.join('\n'));
+    const results: any[] = [];
+    const lines = readline.createInterface({ input: child.stdout });
+    for await (const line of lines) {
+      if (line.trim()) {
+        try {
+          results.push(JSON.parse(line));
+        } catch {
+          // A line cut off by the parser dying; that file is reported as missing below.
+        }
+      }
+    }
+    const exitCode = await exited;
+    if (exitCode !== 0) {
+      if (results.length === 0) {
+        throw new Error(`Failed to run Python parser: exited with code ${exitCode}`);
+      }
+      // Keep what was parsed; files the parser never reported come back as errors.
+      const reported = new Set(results.map((result) => result.path));
+      for (const filePath of context.filePaths) {
+        if (!reported.has(filePath)) {
+          results.push({ path: filePath, type: 'error', error: `Python parser exited with code ${exitCode} before reading this file` });
+        }
+      }
+    }
+    return { results };
+  },
+});
+
 export const listDirectory = createTool({
   id: 'list-directory',
   description: 'Lists the contents of a specified directory with detailed file information',
@@ -117,6 +171,7 @@ export const searchFilesSemantic = createTool({
   inputSchema: z.object({
     query: z.string().describe('The semantic search query'),
     targetDirectory: z.string().describe('The directory to search in').optional(),
+    timeBudgetSeconds: z.number().positive().describe('Return within about this many seconds, with partial results if needed').optional(),
   }),
   outputSchema: z.object({
     text_results: z.array(z.object({
@@ -133,22 +188,50 @@ export const searchFilesSemantic = createTool({
       distance: z.number(),
       caption: z.string(),
     })),
+    partial: z.boolean().optional(),
+    skipped: z.array(z.string()).optional(),
   }),
-  execute: async ({ context }) => {
-    try {
-      const pythonScriptPath = '/Users/rohannair/Desktop/Projects/HackGT/FileAI/cedar-FileAI/src/backend/semanticSearch.py';
-      const args = [
-        context.targetDirectory || '',
-        context.query,
-      ];
-      const { stdout } = await execFileAsync('python3', [pythonScriptPath, ...args], {
-        maxBuffer: 10 * 1024 * 1024, 
-      });
-      const parsed = JSON.parse(stdout);
-      return parsed;
-    } catch (error: any) {
-      throw new Error(`Failed to run Python parser: ${error.message}`);
+  execute: async (args) => {
+    const { context } = args;
+    // Tool-stream writer, when the running Mastra version provides one.
+    const writer = (args as any).writer;
+    const pythonScriptPath = '/Users/rohannair/Desktop/Projects/HackGT/FileAI/cedar-FileAI/src/backend/semanticSearch.py';
+    const scriptArgs = [
+      '--stream',
+      context.targetDirectory || '',
+      context.query,
+      ...(context.timeBudgetSeconds !== undefined ? [String(context.timeBudgetSeconds)] : []),
+    ];
+    // The script writes one JSON event per line as each stage finishes, so hits are
+    // forwarded as they arrive and no single stdout buffer has to hold the result.
+    const child = spawn('python3', [pythonScriptPath, ...scriptArgs], { stdio: ['ignore', 'pipe', 'inherit'] });
+    const exited: Promise<number> = new Promise((resolve, reject) => {
+      child.on('error', reject);
+      child.on('close', (code) => resolve(code ?? -1));
+    });
+    const result: any = { text_results: [], image_results: [] };
+    let error: string | undefined;
+    const lines = readline.createInterface({ input: child.stdout });
+    for await (const line of lines) {
+      if (!line.trim()) {
+        continue;
+      }
+      const event = JSON.parse(line);
+      if (event.type === 'text_results' || event.type === 'image_results') {
+        result[event.type].push(...event.results);
+      } else if (event.type === 'done') {
+        result.partial = event.partial;
+        result.skipped = event.skipped;
+      } else if (event.type === 'error') {
+        error = event.error;
+      }
+      await writer?.write?.(event);
+    }
+    const exitCode = await exited;
+    if (error !== undefined || exitCode !== 0) {
+      throw new Error(`Failed to run Python parser: ${error ?? `exited with code ${exitCode}`}`);
     }
+    return result;
   },
 });
 
@@ -246,6 +329,7 @@ export const createFolder = createTool({
 
 export const fileSystemTools = [
   readFileContent,
+  readFilesContent,
   listDirectory,
   moveFile,
   searchFilesSemantic,
@@ -0,0 +1,32 @@
+import re
+from typing import Iterator, Tuple
+
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces; ~160 words stays under that for
+# ordinary prose, and the overlap keeps phrases that straddle a cut searchable.
+PASSAGE_WORDS = 160
+PASSAGE_OVERLAP = 32
+
+_WORD_RE = re.compile(r"\S+")
+
+
+def iter_passages(text: str, size: int = PASSAGE_WORDS, overlap: int = PASSAGE_OVERLAP) -> Iterator[Tuple[int, int, str]]:
+    """
+    Yield (start, end, passage) windows of `size` words, each sharing `overlap`
+    words with the previous one. Offsets are character positions in `text`.
+    Words are scanned lazily, so at most one window of spans is held at a time.
+    """
+    stride = max(size - overlap, 1)
+    window = []
+    emitted = False
+    for match in _WORD_RE.finditer(text):
+        window.append(match.span())
+        if len(window) == size:
+            start, end = window[0][0], window[-1][1]
+            yield start, end, text[start:end]
+            emitted = True
+            window = window[stride:]
+    # After a full window the leftovers start with its overlap; only emit them if there is new text.
+    if window and (not emitted or len(window) > size - stride):
+        start, end = window[0][0], window[-1][1]
+        yield start, end, text[start:end]
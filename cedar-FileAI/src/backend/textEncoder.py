@@ -0,0 +1,134 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+from typing import List
+
+import numpy as np
+
+
+ENCODE_BUCKET_SIZE = 32
+# Windows queued on the pool before submit() blocks on the oldest one.
+MAX_PENDING_WINDOWS = 4
+
+
+_worker_model = None
+
+
+def _init_worker(threads: int):
+    global _worker_model
+    import torch
+    from modelStore import load_text_model
+    torch.set_num_threads(threads)
+    _worker_model = load_text_model(device='cpu')
+
+
+def _encode_bucket(texts: List[str]) -> np.ndarray:
+    return np.asarray(_worker_model.encode(texts, batch_size=len(texts), convert_to_tensor=False), dtype='float32')
+
+
+def default_worker_count() -> int:
+    cores = os.cpu_count() or 1
+    # Two or more intra-op threads per worker beats one process per core for MiniLM.
+    return max(1, cores // 2)
+
+
+class TextEncoder:
+    """
+    Sentence encoder that accepts windows of passages and hands back their
+    embeddings in submission order.
+
+    Each window is sorted by length and cut into ENCODE_BUCKET_SIZE buckets so a
+    batch never pads a short note up to a long document; buckets are spread over
+    a pool of worker processes (each with its own model copy and thread budget).
+    The first window is encoded in-process with `model`, and the pool is only
+    started once a job turns out to be bigger than that, so small incremental
+    updates never pay for process startup. A model on the GPU encodes every
+    window in-process: the workers would each load a CPU copy instead.
+    """
+
+    def __init__(self, model, workers: int = None, bucket_size: int = ENCODE_BUCKET_SIZE):
+        self.model = model
+        if workers is None:
+            on_gpu = str(getattr(model, 'device', 'cpu')).startswith('cuda')
+            workers = 1 if on_gpu else default_worker_count()
+        self.workers = workers
+        self.bucket_size = bucket_size
+        self.pool = None
+        self.windows_seen = 0
+        self.pending = collections.deque()
+
+    def _start_pool(self):
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        print(f"[INFO] Starting {self.workers} text encoder workers ({threads} threads each)...", file=sys.stderr)
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(threads,),
+        )
+
+    def _buckets(self, texts: List[str]) -> List[np.ndarray]:
+        order = np.argsort([len(t) for t in texts], kind='stable')
+        return [order[i:i + self.bucket_size] for i in range(0, len(order), self.bucket_size)]
+
+    def _encode_local(self, texts: List[str]) -> np.ndarray:
+        out = None
+        for bucket in self._buckets(texts):
+            emb = np.asarray(self.model.encode([texts[i] for i in bucket], batch_size=len(bucket),
+                                               convert_to_tensor=False), dtype='float32')
+            if out is None:
+                out = np.empty((len(texts), emb.shape[1]), dtype='float32')
+            out[bucket] = emb
+        return out
+
+    def _collect(self, block: bool):
+        done = []
+        while self.pending:
+            payload, texts, buckets, futures = self.pending[0]
+            if not block and not all(f.done() for f in futures):
+                break
+            out = None
+            for bucket, future in zip(buckets, futures):
+                emb = future.result()
+                if out is None:
+                    out = np.empty((len(texts), emb.shape[1]), dtype='float32')
+                out[bucket] = emb
+            self.pending.popleft()
+            done.append((payload, texts, out))
+        return done
+
+    def submit(self, texts: List[str], payload=None):
+        """
+        Queue a non-empty window of passages. Returns every (payload, texts, embeddings)
+        window that has finished, oldest first; later windows are returned by
+        later calls or by drain().
+        """
+        self.windows_seen += 1
+        if self.pool is None and (self.workers <= 1 or self.windows_seen == 1):
+            return [(payload, texts, self._encode_local(texts))]
+        if self.pool is None:
+            self._start_pool()
+        buckets = self._buckets(texts)
+        futures = [self.pool.submit(_encode_bucket, [texts[i] for i in bucket]) for bucket in buckets]
+        self.pending.append((payload, texts, buckets, futures))
+        done = self._collect(block=False)
+        while len(self.pending) > MAX_PENDING_WINDOWS:
+            concurrent.futures.wait(self.pending[0][3])
+            done.extend(self._collect(block=False))
+        return done
+
+    def drain(self):
+        return self._collect(block=True)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,103 @@
+import codecs
+import io
+import re
+import sys
+from typing import Iterable, Iterator, Optional
+
+
+# Text files are read up to this many bytes; the rest of a huge log or export is skipped.
+TEXT_BYTE_BUDGET = 64 * 1024 * 1024
+READ_CHUNK_CHARS = 1024 * 1024
+SNIFF_BYTES = 64 * 1024
+# A sample with more NUL bytes than this (and not laid out like UTF-16) is binary, not UTF-8 text.
+MAX_NUL_SHARE = 0.1
+# A run this long without any sentence terminator or newline is dropped rather than buffered.
+MAX_PENDING_CHARS = 1024 * 1024
+
+# Longest BOMs first: the UTF-32-LE BOM starts with the UTF-16-LE one.
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+_SENTENCE_RE = re.compile(r"[A-Z0-9][^.!?\n]*[.!?]", flags=re.M)
+
+
+def detect_encoding(sample: bytes) -> Optional[str]:
+    """
+    Encoding of a file from its first bytes: a BOM if there is one, else
+    BOM-less UTF-16 if every other byte is mostly NUL, else UTF-8 if the sample
+    decodes and is not NUL-heavy. None means binary or an unsupported encoding.
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    # Before UTF-8: NUL is valid UTF-8, so UTF-16 text of ASCII characters decodes as UTF-8 too.
+    half = len(sample) // 2
+    if half:
+        even_nuls, odd_nuls = sample[0::2].count(0), sample[1::2].count(0)
+        if odd_nuls > 0.3 * half and even_nuls < 0.05 * half:
+            return 'utf-16-le'
+        if even_nuls > 0.3 * half and odd_nuls < 0.05 * half:
+            return 'utf-16-be'
+    if sample.count(0) > MAX_NUL_SHARE * len(sample):
+        return None
+    try:
+        # final=False: the sample may end inside a multi-byte character.
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return None
+
+
+def iter_text_chunks(filepath: str, byte_budget: int = TEXT_BYTE_BUDGET,
+                     chunk_chars: int = READ_CHUNK_CHARS) -> Iterator[str]:
+    """
+    Decode a text file in chunks of about `chunk_chars` characters, in one pass
+    and with universal newlines, stopping after roughly `byte_budget` bytes.
+    The encoding is detected once from the first SNIFF_BYTES; bytes that do not
+    decode later on are replaced rather than restarting with another encoding.
+    Raises UnicodeError if the file does not look like text.
+    """
+    with open(filepath, 'rb') as raw:
+        encoding = detect_encoding(raw.read(SNIFF_BYTES))
+        if encoding is None:
+            raise UnicodeError(f"unsupported encoding or binary file: {filepath}")
+        raw.seek(0)
+        reader = io.TextIOWrapper(raw, encoding=encoding, errors='replace', newline=None)
+        while True:
+            size = chunk_chars
+            if byte_budget is not None:
+                # Every character takes at least one byte, so this never reads far past the budget.
+                size = min(size, max(1, byte_budget - raw.tell()))
+            chunk = reader.read(size)
+            if not chunk:
+                return
+            yield chunk
+            if byte_budget is not None and raw.tell() >= byte_budget:
+                print(f"[INFO] Stopped reading {filepath} at its byte budget ({byte_budget} bytes)", file=sys.stderr)
+                return
+
+
+def read_text(filepath: str, byte_budget: int = TEXT_BYTE_BUDGET) -> str:
+    return ''.join(iter_text_chunks(filepath, byte_budget))
+
+
+def iter_semantic_sentences(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Streaming version of re.findall(r"[A-Z0-9][^.!?\\n]*[.!?]", text): each chunk
+    is scanned up to its last sentence terminator or newline, which no match
+    can cross, and only the text after it is carried into the next chunk.
+    """
+    pending = ''
+    for chunk in chunks:
+        text = pending + chunk
+        cut = max(text.rfind(c) for c in '.!?\n') + 1
+        yield from _SENTENCE_RE.findall(text, 0, cut)
+        pending = text[cut:]
+        if len(pending) > MAX_PENDING_CHARS:
+            pending = ''
+    yield from _SENTENCE_RE.findall(pending)
@@ -0,0 +1,270 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+
+import faiss
+import numpy as np
+
+from ingestCheckpoint import atomic_write_json
+from keywordIndex import KeywordIndex
+from segmentStore import COPY_CHUNK_ROWS, NpyRowWriter, StackedRows, directory_lock, index_vectors, write_npz_atomic
+
+
+MANIFEST_NAME = 'text_manifest.json'
+# The newest segment is merged into the one before it once it reaches this share of
+# its size, so sizes roughly double going back and a row is rewritten O(log n) times.
+MERGE_SHARE = 0.5
+# Rows of deleted or re-parsed files above this share of all stored rows trigger a full rewrite.
+MAX_DEAD_SHARE = 0.5
+
+
+class TextSegmentStore:
+    """
+    Append-only storage of the passage index, laid out like the image SegmentStore.
+
+    An update writes one immutable segment holding only its new passages: their
+    embeddings as a .npy (memory-mapped on load) and an .npz with each row's file
+    and character span, the rows' BM25 postings and, when a projection is in use,
+    the projected vectors. The manifest lists the segments and every file ever
+    indexed with its (mtime, size), or null once the file was deleted or
+    re-parsed; rows of such files are skipped on load. An update therefore
+    writes its own rows plus a manifest of O(files), never the whole index.
+
+    maintain() merges the newest segment into the one before it once it reaches
+    MERGE_SHARE of its size, and rewrites everything into one segment (dropping
+    dead rows and renumbering files) once dead rows pass MAX_DEAD_SHARE or the
+    stored projected vectors belong to an older projection.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, MANIFEST_NAME)
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _path(self, name: str, ext: str) -> str:
+        return os.path.join(self.store_dir, name + ext)
+
+    def _read_segment(self, segment):
+        embeddings = np.load(self._path(segment['name'], '.npy'), mmap_mode='r')
+        with np.load(self._path(segment['name'], '.npz')) as data:
+            arrays = {key: data[key] for key in data.files}
+        arrays['files'] = arrays['files'] + segment['file_base']
+        return embeddings, arrays
+
+    def _remove_segment(self, segment):
+        for ext in ('.npy', '.npz'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path(segment['name'], ext))
+
+    def open_segment(self, dim: int) -> NpyRowWriter:
+        """Start a segment whose embeddings are appended as they are encoded; finish it with write_segment()."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        return NpyRowWriter(self._path(f"tseg_{time.time_ns()}_{os.getpid()}", '.npy'), dim)
+
+    def write_segment(self, embeddings: NpyRowWriter, files, offsets, keyword_index: KeywordIndex,
+                      projected=None, projection_rows: int = None) -> dict:
+        """
+        Finish (but do not publish) a segment from open_segment(); `files` index
+        into the paths later passed to commit().
+        """
+        embeddings.close()
+        name = os.path.basename(embeddings.file_path)[:-len('.npy')]
+        arrays = keyword_index.arrays('kw_')
+        if projected is not None:
+            arrays['projected'] = np.ascontiguousarray(projected, dtype='float32')
+        write_npz_atomic(self._path(name, '.npz'), files=np.asarray(files, dtype=np.int64),
+                         offsets=np.asarray(offsets, dtype=np.int64).reshape(-1, 2), **arrays)
+        return {"name": name, "rows": int(len(files)), "file_base": 0, "projection_rows": projection_rows}
+
+    def commit(self, segment: Optional[dict], new_paths: List[str], new_stats, new_rows: List[int],
+               dead_paths: List[str], dim: int) -> int:
+        """
+        Publish `segment` (or None if no passages were added) together with its
+        files. Files in `dead_paths`, and older entries of the paths in
+        `new_paths`, stop being live. Returns the generation this commit replaced,
+        so a caller can tell whether anyone else committed since it loaded.
+        """
+        with directory_lock(self.store_dir):
+            manifest = self.read_manifest()
+            if manifest is not None and manifest['dim'] != dim:
+                print(f"[INFO] Text embedding size changed ({manifest['dim']} -> {dim}); starting a new text index.",
+                      file=sys.stderr)
+                for old in manifest['segments']:
+                    self._remove_segment(old)
+                manifest = dict(manifest, segments=[], file_paths=[], file_stats=[], file_rows=[], dead_rows=0)
+            if manifest is None:
+                manifest = {"generation": 0, "dim": dim, "segments": [], "file_paths": [], "file_stats": [],
+                            "file_rows": [], "dead_rows": 0}
+            manifest['dim'] = dim
+            live_of = {path: i for i, (path, stat) in enumerate(zip(manifest['file_paths'], manifest['file_stats']))
+                       if stat is not None}
+            for path in set(dead_paths) | set(new_paths):
+                i = live_of.get(path)
+                if i is not None:
+                    manifest['file_stats'][i] = None
+                    manifest['dead_rows'] += manifest['file_rows'][i]
+            if segment is not None:
+                manifest['segments'].append(dict(segment, file_base=len(manifest['file_paths'])))
+            manifest['file_paths'].extend(new_paths)
+            manifest['file_stats'].extend(list(stat) for stat in new_stats)
+            manifest['file_rows'].extend(new_rows)
+            previous = manifest['generation']
+            manifest['generation'] = previous + 1
+            atomic_write_json(self.manifest_path, manifest)
+        return previous
+
+    def load(self, projection=None):
+        """
+        (embeddings_np, index, keyword_index, file_paths, file_stats, passage_files,
+        passage_offsets, generation) over the live rows, or None for an empty store.
+
+        `file_stats[i]` is None for files that are no longer live, and
+        `passage_files` holds file indices in non-decreasing order. Without a
+        projection the index holds the full vectors and embeddings_np is a view
+        of them; with one it holds projected vectors and embeddings_np reads the
+        full ones from the memory-mapped segments.
+        """
+        with directory_lock(self.store_dir, shared=True):
+            manifest = self.read_manifest()
+            if manifest is None:
+                return None
+            dim = manifest['dim']
+            alive = np.array([stat is not None for stat in manifest['file_stats']] + [False], dtype=bool)
+            index = faiss.IndexFlatL2(dim if projection is None else projection.dim_out)
+            keyword_index = KeywordIndex()
+            parts, raw_rows, file_parts, offset_parts = [], [], [], []
+            raw_base = 0
+            for segment in manifest['segments']:
+                embeddings, arrays = self._read_segment(segment)
+                live = np.flatnonzero(alive[arrays['files']])
+                segment_keywords = KeywordIndex.from_arrays(arrays, 'kw_')
+                if live.size < segment['rows']:
+                    segment_keywords.keep_documents(live)
+                keyword_index.extend(segment_keywords)
+                stored = (projection is not None and 'projected' in arrays
+                          and segment.get('projection_rows') == projection.trained_rows)
+                for start in range(0, live.size, COPY_CHUNK_ROWS):
+                    rows = live[start:start + COPY_CHUNK_ROWS]
+                    if projection is None:
+                        index.add(np.ascontiguousarray(embeddings[rows], dtype='float32'))
+                    elif stored:
+                        index.add(np.ascontiguousarray(arrays['projected'][rows]))
+                    else:
+                        index.add(projection.apply(embeddings[rows]))
+                if projection is not None:
+                    parts.append(embeddings)
+                    raw_rows.append(raw_base + live)
+                    raw_base += segment['rows']
+                file_parts.append(arrays['files'][live])
+                offset_parts.append(arrays['offsets'][live])
+        if projection is None:
+            embeddings_np = index_vectors(index)
+        else:
+            embeddings_np = StackedRows(parts, np.concatenate(raw_rows + [np.array([], dtype=np.int64)]), dim)
+        passage_files = np.concatenate(file_parts + [np.array([], dtype=np.int64)])
+        passage_offsets = np.concatenate(offset_parts + [np.empty((0, 2), dtype=np.int64)])
+        file_stats = [tuple(stat) if stat is not None else None for stat in manifest['file_stats']]
+        return (embeddings_np, index, keyword_index, manifest['file_paths'], file_stats,
+                passage_files, passage_offsets, manifest['generation'])
+
+    def _merge(self, segments, alive: np.ndarray, renumber: np.ndarray, projection=None) -> dict:
+        # Copies the live rows of `segments` into one new segment, in order, streaming the embeddings.
+        reads = [self._read_segment(segment) for segment in segments]
+        lives = [np.flatnonzero(alive[arrays['files']]) for _, arrays in reads]
+        total = int(sum(live.size for live in lives))
+        dim = reads[0][0].shape[1]
+        name = f"tseg_{time.time_ns()}_{os.getpid()}"
+        tmp_path = self._path(name, '.npy') + '.tmp'
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype='float32', shape=(total, dim))
+        keyword_index = KeywordIndex()
+        files, offsets, projected = [], [], []
+        row = 0
+        for segment, (embeddings, arrays), live in zip(segments, reads, lives):
+            stored = (projection is not None and 'projected' in arrays
+                      and segment.get('projection_rows') == projection.trained_rows)
+            for start in range(0, live.size, COPY_CHUNK_ROWS):
+                rows = live[start:start + COPY_CHUNK_ROWS]
+                out[row:row + rows.size] = embeddings[rows]
+                if projection is not None:
+                    projected.append(arrays['projected'][rows] if stored else projection.apply(embeddings[rows]))
+                row += rows.size
+            segment_keywords = KeywordIndex.from_arrays(arrays, 'kw_')
+            if live.size < segment['rows']:
+                segment_keywords.keep_documents(live)
+            keyword_index.extend(segment_keywords)
+            files.append(renumber[arrays['files'][live]])
+            offsets.append(arrays['offsets'][live])
+        out.flush()
+        del out
+        os.replace(tmp_path, self._path(name, '.npy'))
+        arrays = keyword_index.arrays('kw_')
+        if projection is not None:
+            arrays['projected'] = np.concatenate(projected + [np.empty((0, projection.dim_out), dtype='float32')])
+        write_npz_atomic(self._path(name, '.npz'), files=np.concatenate(files), offsets=np.concatenate(offsets),
+                         **arrays)
+        return {"name": name, "rows": total, "file_base": 0,
+                "projection_rows": projection.trained_rows if projection is not None else None}
+
+    def _maintenance_due(self, manifest, projection=None) -> bool:
+        segments = manifest['segments']
+        total = sum(segment['rows'] for segment in segments)
+        stale_projection = projection is not None and any(
+            segment.get('projection_rows') != projection.trained_rows for segment in segments)
+        tail_merge = len(segments) >= 2 and segments[-1]['rows'] >= MERGE_SHARE * segments[-2]['rows']
+        return bool(segments) and (manifest['dead_rows'] > MAX_DEAD_SHARE * total or stale_projection or tail_merge)
+
+    def maintain(self, projection=None):
+        """Merge segments as described in the class docstring; holds the exclusive lock throughout."""
+        with directory_lock(self.store_dir):
+            manifest = self.read_manifest()
+            if manifest is None or not self._maintenance_due(manifest, projection):
+                return
+            segments = manifest['segments']
+            alive = np.array([stat is not None for stat in manifest['file_stats']] + [False], dtype=bool)
+            total = sum(segment['rows'] for segment in segments)
+            stale_projection = projection is not None and any(
+                segment.get('projection_rows') != projection.trained_rows for segment in segments)
+            if manifest['dead_rows'] > MAX_DEAD_SHARE * total or stale_projection:
+                live_files = np.flatnonzero(alive[:-1])
+                renumber = np.full(alive.size, -1, dtype=np.int64)
+                renumber[live_files] = np.arange(live_files.size)
+                merged = segments
+                manifest['segments'] = [self._merge(segments, alive, renumber, projection)]
+                for key in ('file_paths', 'file_stats', 'file_rows'):
+                    manifest[key] = [manifest[key][i] for i in live_files.tolist()]
+                manifest['dead_rows'] = 0
+                print(f"[INFO] Rewrote the text index ({total} rows) into one segment.", file=sys.stderr)
+            else:
+                identity = np.arange(alive.size, dtype=np.int64)
+                merged = []
+                while len(segments) >= 2 and segments[-1]['rows'] >= MERGE_SHARE * segments[-2]['rows']:
+                    pair = segments[-2:]
+                    merged.extend(pair)
+                    segment = self._merge(pair, alive, identity, projection)
+                    manifest['dead_rows'] -= sum(s['rows'] for s in pair) - segment['rows']
+                    segments = segments[:-2] + [segment]
+                manifest['segments'] = segments
+            manifest['generation'] += 1
+            atomic_write_json(self.manifest_path, manifest)
+            # Readers hold the shared lock while loading, and mappings of removed files stay valid.
+            for segment in merged:
+                self._remove_segment(segment)
+
+    def maintain_in_background(self, projection=None) -> Optional[threading.Thread]:
+        manifest = self.read_manifest()
+        if manifest is None or not self._maintenance_due(manifest, projection):
+            return None
+        # Not a daemon: a short-lived CLI run finishes its merge before exiting.
+        thread = threading.Thread(target=self.maintain, args=(projection,), name='text-segment-merge')
+        thread.start()
+        return thread
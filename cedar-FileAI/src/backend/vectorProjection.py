@@ -0,0 +1,212 @@
+import json
+import os
+import sys
+from typing import Optional, Sequence
+
+import faiss
+import numpy as np
+
+from ingestCheckpoint import atomic_write_json
+from pathIndex import SUBSET_SCAN_FRACTION, search_within
+from segmentStore import directory_lock
+
+
+# 'pca' or 'opq'. OPQ needs enough rows to train its 256-centroid codebooks.
+PROJECTION_KIND = 'pca'
+OPQ_SUBVECTOR_DIM = 4
+OPQ_MIN_TRAIN_ROWS = 10000
+PROJECTION_TRAIN_ROWS = 100000
+# A projection is retrained once the index has grown this much past its training set.
+RETRAIN_GROWTH = 2.0
+# Candidates fetched from the reduced index per result before full-vector re-scoring.
+RESCORE_FACTOR = 4
+RECALL_K = 10
+RECALL_QUERIES = 200
+RECALL_REPORT_DIMS = (64, 128, 256)
+APPLY_CHUNK_ROWS = 65536
+# Taken around reading and replacing the .faiss/.json pair; not the store's own lock,
+# which a background merge can hold for a while.
+LOCK_NAME = '.projection.lock'
+
+
+def _sample_rows(n: int, count: int, seed: int = 0) -> np.ndarray:
+    if n <= count:
+        return np.arange(n)
+    return np.sort(np.random.default_rng(seed).choice(n, count, replace=False))
+
+
+class VectorProjection:
+    """
+    A trained PCA or OPQ transform from full embeddings down to `dim_out`
+    dimensions, stored next to the index it was trained for as a FAISS
+    VectorTransform plus a small JSON file with its settings and measured recall.
+    """
+
+    def __init__(self, transform, kind: str, trained_rows: int, recall=None, requested_kind: str = None,
+                 requested_dim: int = None):
+        self.transform = transform
+        self.kind = kind
+        # What the configuration asked for; differs from `kind` when OPQ fell back to PCA,
+        # and from `dim_out` when OPQ rounded it to whole subvectors.
+        self.requested_kind = requested_kind or kind
+        self.requested_dim = requested_dim or transform.d_out
+        self.trained_rows = trained_rows
+        self.recall = recall or {}
+
+    @property
+    def dim_in(self) -> int:
+        return self.transform.d_in
+
+    @property
+    def dim_out(self) -> int:
+        return self.transform.d_out
+
+    @classmethod
+    def train(cls, embeddings_np, dim_out: int, kind: str = PROJECTION_KIND) -> Optional['VectorProjection']:
+        n, d = embeddings_np.shape
+        requested_kind = kind
+        if dim_out <= 0 or dim_out >= d or n < dim_out:
+            return None
+        if kind == 'opq' and n < OPQ_MIN_TRAIN_ROWS:
+            print(f"[INFO] {n} vectors are too few to train OPQ; using PCA instead.", file=sys.stderr)
+            kind = 'pca'
+        sample = np.ascontiguousarray(embeddings_np[_sample_rows(n, PROJECTION_TRAIN_ROWS)], dtype='float32')
+        if kind == 'opq':
+            subquantizers = max(1, dim_out // OPQ_SUBVECTOR_DIM)
+            transform = faiss.OPQMatrix(d, subquantizers, subquantizers * OPQ_SUBVECTOR_DIM)
+        else:
+            transform = faiss.PCAMatrix(d, dim_out)
+        transform.train(sample)
+        return cls(transform, kind, n, requested_kind=requested_kind, requested_dim=dim_out)
+
+    def apply(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors).reshape(-1, self.dim_in)
+        out = np.empty((vectors.shape[0], self.dim_out), dtype='float32')
+        for start in range(0, vectors.shape[0], APPLY_CHUNK_ROWS):
+            chunk = np.ascontiguousarray(vectors[start:start + APPLY_CHUNK_ROWS], dtype='float32')
+            out[start:start + chunk.shape[0]] = self.transform.apply(chunk)
+        return out
+
+    def build_index(self, embeddings_np) -> faiss.IndexFlatL2:
+        index = faiss.IndexFlatL2(self.dim_out)
+        for start in range(0, embeddings_np.shape[0], APPLY_CHUNK_ROWS):
+            index.add(self.apply(embeddings_np[start:start + APPLY_CHUNK_ROWS]))
+        return index
+
+    def save(self, prefix: str):
+        # Searches in other processes may train and save at the same time; the lock
+        # keeps the two files of one projection together and their temp names private.
+        with directory_lock(os.path.dirname(prefix) or '.', name=LOCK_NAME):
+            tmp_path = prefix + '.faiss.tmp'
+            faiss.write_VectorTransform(self.transform, tmp_path)
+            os.replace(tmp_path, prefix + '.faiss')
+            atomic_write_json(prefix + '.json', {"kind": self.kind, "requested_kind": self.requested_kind,
+                                                 "dim_in": self.dim_in, "dim_out": self.dim_out,
+                                                 "requested_dim": self.requested_dim,
+                                                 "trained_rows": self.trained_rows, "recall": self.recall})
+
+    @classmethod
+    def load(cls, prefix: str, dim_out: int, kind: str = PROJECTION_KIND) -> Optional['VectorProjection']:
+        """The stored projection, or None if there is none or it was trained for other settings."""
+        if dim_out <= 0:
+            return None
+        try:
+            with directory_lock(os.path.dirname(prefix) or '.', shared=True, name=LOCK_NAME):
+                with open(prefix + '.json', 'r') as f:
+                    meta = json.load(f)
+                if (meta.get('requested_dim', meta['dim_out']) != dim_out
+                        or meta.get('requested_kind', meta['kind']) != kind):
+                    return None
+                transform = faiss.read_VectorTransform(prefix + '.faiss')
+        except (OSError, ValueError, KeyError, RuntimeError):
+            return None
+        return cls(transform, meta['kind'], meta['trained_rows'], meta.get('recall'), meta.get('requested_kind'),
+                   meta.get('requested_dim'))
+
+
+def measure_recall(embeddings_np, projection: VectorProjection, k: int = RECALL_K,
+                   queries: int = RECALL_QUERIES) -> float:
+    """
+    Recall@k of projected search plus full-vector re-scoring against exact
+    search, using a sample of stored vectors as queries (each excluding itself).
+    """
+    n = embeddings_np.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        return 1.0
+    base = np.ascontiguousarray(embeddings_np, dtype='float32')
+    query_ids = _sample_rows(n, queries, seed=1)
+    xq = base[query_ids]
+    _, exact = faiss.knn(xq, base, k + 1)
+    _, candidates = faiss.knn(projection.apply(xq), projection.apply(base), min(n, (k + 1) * RESCORE_FACTOR))
+    hits = 0
+    for qi, row in enumerate(query_ids):
+        truth = set(exact[qi].tolist()) - {row}
+        cand = candidates[qi][candidates[qi] != row]
+        dists = ((base[cand] - xq[qi]) ** 2).sum(axis=1)
+        found = set(cand[np.argsort(dists)[:k]].tolist())
+        hits += len(truth & found) / max(1, len(truth))
+    return hits / len(query_ids)
+
+
+def ensure_projection(prefix: str, embeddings_np, dim_out: int, kind: str = PROJECTION_KIND,
+                      report_dims: Sequence[int] = RECALL_REPORT_DIMS) -> Optional[VectorProjection]:
+    """
+    Load the projection stored at `prefix`, or train, evaluate and store a new
+    one when there is none for these settings or the index has outgrown it.
+    Recall is printed for the configured dimension and each of `report_dims`.
+    """
+    if dim_out <= 0 or embeddings_np is None:
+        return None
+    n = embeddings_np.shape[0]
+    projection = VectorProjection.load(prefix, dim_out, kind)
+    if projection is not None and n < RETRAIN_GROWTH * projection.trained_rows:
+        return projection
+    projection = VectorProjection.train(embeddings_np, dim_out, kind)
+    if projection is None:
+        print(f"[INFO] Not projecting {n}x{embeddings_np.shape[1]} vectors to {dim_out} dimensions.", file=sys.stderr)
+        return None
+    for dim in sorted(set(report_dims) | {dim_out}):
+        candidate = projection if dim == dim_out else VectorProjection.train(embeddings_np, dim, kind)
+        if candidate is None:
+            continue
+        recall = measure_recall(embeddings_np, candidate)
+        projection.recall[str(dim)] = recall
+        marker = " (selected)" if dim == dim_out else ""
+        print(f"[INFO] {candidate.kind.upper()} {embeddings_np.shape[1]}->{dim}: recall@{RECALL_K} {recall:.3f}{marker}",
+              file=sys.stderr)
+    projection.save(prefix)
+    return projection
+
+
+def search_vectors(index, embeddings_np, query_np, k: int, ids=None, projection: VectorProjection = None):
+    """
+    FAISS-style (distances, indices) search over `index`, optionally restricted
+    to `ids`. With a projection, `index` holds projected vectors: it returns
+    k * RESCORE_FACTOR candidates that are re-ranked by exact distance on the
+    full `embeddings_np`, so the returned distances are always full-dimensional.
+    """
+    query_np = np.asarray(query_np, dtype=np.float32).reshape(1, -1)
+    if projection is None:
+        if ids is None:
+            return index.search(query_np, min(k, index.ntotal))
+        return search_within(index, embeddings_np, query_np, ids, k)
+    if ids is not None and ids.size <= SUBSET_SCAN_FRACTION * index.ntotal:
+        # Small subsets are brute-forced on the full vectors anyway.
+        return search_within(index, embeddings_np, query_np, ids, k)
+    fetch = k * RESCORE_FACTOR
+    reduced_query = projection.apply(query_np)
+    if ids is None:
+        _, candidates = index.search(reduced_query, min(fetch, index.ntotal))
+        candidates = candidates[0][candidates[0] >= 0]
+    else:
+        _, candidates = search_within(index, None, reduced_query, ids, fetch)
+        candidates = candidates[0]
+    if candidates.size == 0:
+        return np.empty((1, 0), dtype=np.float32), np.empty((1, 0), dtype=np.int64)
+    order = np.argsort(candidates)
+    rows = np.asarray(embeddings_np[candidates[order]], dtype=np.float32)
+    dists = np.empty(candidates.size, dtype=np.float32)
+    dists[order] = ((rows - query_np) ** 2).sum(axis=1)
+    top = np.argsort(dists, kind='stable')[:k]
+    return dists[top][None, :], candidates[top][None, :]